@@ -2,33 +2,116 @@
 Enhanced LangGraph agent with Gmail, Calendar, and Memory integration.
 Provides contextual, intelligent assistance as a "Chief of Staff".
 """
-from typing import TypedDict, Annotated, List, Dict, Any, Optional
+from typing import TypedDict, Annotated, List, Dict, Any, Optional, Tuple
+
+import logging
+
+# Swap in the Rust executor/channel-write kernels before langgraph is imported
+try:
+    import fast_langgraph
+    fast_langgraph.shim.patch_langgraph()
+except ImportError:
+    pass
+except Exception as e:
+    # An installed but incompatible shim must not stop the agent from loading
+    logging.getLogger(__name__).warning(f"fast-langgraph shim not applied: {e}")
+
 from langgraph.graph import StateGraph, END
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.schema import HumanMessage, AIMessage
-import logging
-import json
+from langchain.schema import BaseMessage, HumanMessage, AIMessage
+from cachetools import LRUCache
+import operator
+import asyncio
+import functools
+import hashlib
+import re
+
+import numpy as np
+import orjson
 
 from config import settings
+from embeddings import embedder
+from semantic_cache import semantic_cache
 from memory_brain import memory_brain, MemoryCategory
-from gmail_tools import gmail_tools
+from gmail_tools import INTERACTIVE_RETRY, gmail_tools
 from calendar_tools import calendar_tools
 
 logger = logging.getLogger(__name__)
 
+# Intent keywords in priority order: specific phrases first, then Gmail before Calendar
+_INTENT_KEYWORDS = [
+    ("important emails", "gmail", "get_important_emails"),
+    ("send email", "gmail", "send_email"),
+    ("next meeting", "calendar", "get_next_meeting"),
+    ("inbox", "gmail", "fetch_emails"),
+    ("email", "gmail", "fetch_emails"),
+    ("mail", "gmail", "fetch_emails"),
+    ("unread", "gmail", "get_important_emails"),
+    ("reply", "gmail", "send_email"),
+    ("calendar", "calendar", "get_upcoming_events"),
+    ("schedule", "calendar", "get_today_schedule"),
+    ("today", "calendar", "get_today_schedule"),
+    ("meetings", "calendar", "get_upcoming_events"),
+    ("events", "calendar", "get_upcoming_events"),
+    ("available", "calendar", "check_availability"),
+    ("free", "calendar", "check_availability"),
+]
+_INTENT_PRIORITY = {keyword: i for i, (keyword, _, _) in enumerate(_INTENT_KEYWORDS)}
+# Longest-first alternation so phrases win over the words they contain
+_INTENT_PATTERN = re.compile("|".join(
+    re.escape(keyword) for keyword in sorted(_INTENT_PRIORITY, key=len, reverse=True)
+))
+
+# Pretty-printed JSON for tool data embedded in the prompt
+_JSON_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_NAIVE_UTC
+
+# Greetings and acknowledgements answered without running the graph
+_TRIVIAL = re.compile(
+    r"(hi|hello|hey|thanks|thank you|ok|okay|got it|cool|nice)[!.?\s]*",
+    re.IGNORECASE
+)
+_GREETING_REPLY = "Hello! How can I help you today?"
+_THANKS_REPLY = "You're welcome! Let me know if there's anything else I can help with."
+_ACK_REPLY = "Great! Let me know if you need anything else."
+_TRIVIAL_REPLIES = {
+    "hi": _GREETING_REPLY,
+    "hello": _GREETING_REPLY,
+    "hey": _GREETING_REPLY,
+    "thanks": _THANKS_REPLY,
+    "thank you": _THANKS_REPLY,
+    "ok": _ACK_REPLY,
+    "okay": _ACK_REPLY,
+    "got it": _ACK_REPLY,
+    "cool": _ACK_REPLY,
+    "nice": _ACK_REPLY,
+}
+
+# Instructions shared by every turn; kept byte-identical so prompt prefixes cache
+_STATIC_SYSTEM_PROMPT = """You are an intelligent AI assistant acting as a personal "Chief of Staff". 
+You help users manage their day by accessing their Gmail and Calendar when needed.
+
+Your capabilities:
+- Read and summarize emails from the user's inbox
+- Check calendar events and schedules
+- Help draft and send email replies
+- Remember user preferences and context
+
+Be concise, professional, and proactive. Provide actionable insights.
+Use any context given after the conversation to answer the latest message."""
+
 
 class AgentState(TypedDict):
-    """State for the agent graph."""
-    messages: List[Dict[str, str]]
+    """State for the agent graph. Nodes return only the keys they change."""
+    messages: Annotated[List[Dict[str, str]], operator.add]
     user_id: str
+    session_id: Optional[str]
     conversation_id: str
-    memory_context: List[Dict[str, Any]]
+    memory_context: Annotated[List[Dict[str, Any]], operator.add]
     response: str
+    query_embedding: Optional[np.ndarray]
     needs_tool: bool
-    tool_name: str
-    tool_action: str
-    tool_params: Dict[str, Any]
-    tool_result: Any
+    tool_calls: List[Dict[str, Any]]
+    tool_results: List[Dict[str, Any]]
 
 
 class AgenticAssistant:
@@ -44,15 +127,28 @@ class AgenticAssistant:
             timeout=30
         )
         self.graph = self._build_graph()
+        self.trivial_skip_total = 0
         
-        # Tool definitions for the agent
+        # Built once so every turn starts with the same prompt prefix
+        self._system_message = HumanMessage(content=f"System Instructions: {_STATIC_SYSTEM_PROMPT}")
+        
+        # Formatted tool results keyed by (tool name, result digest)
+        self._format_cache = LRUCache(maxsize=256)
+        
+        # LangChain wrappers of stored messages, keyed by message id since stored messages never change
+        self._history_cache = LRUCache(maxsize=10_000)
+        
+        # In-flight memory extraction tasks
+        self._background_tasks = set()
+        
+        # Tool definitions for the agent; Gmail calls get a short retry budget so a throttle cannot stall the reply
         self.tools = {
             "gmail": {
-                "fetch_emails": gmail_tools.fetch_emails,
-                "search_emails": gmail_tools.search_emails,
-                "get_email_details": gmail_tools.get_email_details,
-                "send_email": gmail_tools.send_email,
-                "get_important_emails": gmail_tools.get_important_emails,
+                "fetch_emails": functools.partial(gmail_tools.fetch_emails, retry=INTERACTIVE_RETRY),
+                "search_emails": functools.partial(gmail_tools.search_emails, retry=INTERACTIVE_RETRY),
+                "get_email_details": functools.partial(gmail_tools.get_email_details, retry=INTERACTIVE_RETRY),
+                "send_email": functools.partial(gmail_tools.send_email, retry=INTERACTIVE_RETRY),
+                "get_important_emails": functools.partial(gmail_tools.get_important_emails, retry=INTERACTIVE_RETRY),
             },
             "calendar": {
                 "get_upcoming_events": calendar_tools.get_upcoming_events,
@@ -67,153 +163,148 @@ class AgenticAssistant:
         workflow = StateGraph(AgentState)
         
         # Add nodes
-        workflow.add_node("retrieve_memory", self._retrieve_memory)
-        workflow.add_node("analyze_intent", self._analyze_intent)
-        workflow.add_node("execute_tool", self._execute_tool)
+        workflow.add_node("prepare", self._prepare)
         workflow.add_node("generate_response", self._generate_response)
-        workflow.add_node("extract_memory", self._extract_memory)
         
         # Add edges
-        workflow.set_entry_point("retrieve_memory")
-        workflow.add_edge("retrieve_memory", "analyze_intent")
-        workflow.add_conditional_edges(
-            "analyze_intent",
-            self._should_use_tool,
-            {
-                "execute_tool": "execute_tool",
-                "generate_response": "generate_response"
-            }
-        )
-        workflow.add_edge("execute_tool", "generate_response")
-        workflow.add_edge("generate_response", "extract_memory")
-        workflow.add_edge("extract_memory", END)
+        workflow.set_entry_point("prepare")
+        workflow.add_edge("prepare", "generate_response")
+        workflow.add_edge("generate_response", END)
         
         return workflow.compile()
     
-    async def _retrieve_memory(self, state: AgentState) -> AgentState:
+    async def _prepare(self, state: AgentState) -> Dict[str, Any]:
+        """Retrieve memory context and run any matched tools concurrently."""
+        user_message = state["messages"][-1]["content"] if state["messages"] else ""
+        tool_calls = self._analyze_intent(user_message)
+        
+        # Memory retrieval and tool calls are independent, so fan them out together.
+        # There is at most one call per Google API, so a per-API HTTP batch would hold a single request.
+        (query_embedding, memories), *tool_results = await asyncio.gather(
+            self._embed_and_retrieve_memory(state["user_id"], user_message),
+            *(self._execute_tool(state["user_id"], state.get("session_id"), call) for call in tool_calls)
+        )
+        
+        return {
+            "query_embedding": query_embedding,
+            "memory_context": memories,
+            "needs_tool": bool(tool_calls),
+            "tool_calls": tool_calls,
+            "tool_results": tool_results
+        }
+    
+    async def _embed_and_retrieve_memory(
+        self,
+        user_id: str,
+        user_message: str
+    ) -> Tuple[Optional[np.ndarray], List[Dict[str, Any]]]:
+        """Embed the user message once per turn and use it for memory retrieval."""
+        query_embedding = await asyncio.to_thread(embedder.encode, user_message)
+        memories = await self._retrieve_memory(user_id, user_message, query_embedding)
+        return query_embedding, memories
+    
+    async def _retrieve_memory(
+        self,
+        user_id: str,
+        user_message: str,
+        query_embedding: Optional[np.ndarray] = None
+    ) -> List[Dict[str, Any]]:
         """Retrieve relevant memory context."""
         try:
-            user_message = state["messages"][-1]["content"] if state["messages"] else ""
-            
-            # Get relevant memories based on context
+            # Get relevant memories based on context; memory_brain caches recent lookups
             memories = await memory_brain.retrieve_relevant_memories(
-                user_id=state["user_id"],
+                user_id=user_id,
                 context=user_message,
-                limit=5
+                limit=5,
+                query_embedding=query_embedding
             )
             
-            state["memory_context"] = memories
-            logger.info(f"Retrieved {len(memories)} relevant memories for user {state['user_id']}")
+            logger.info(f"Retrieved {len(memories)} relevant memories for user {user_id}")
+            return memories
             
         except Exception as e:
             logger.error(f"Error retrieving memory: {e}")
-            state["memory_context"] = []
-        
-        return state
+            return []
     
-    async def _analyze_intent(self, state: AgentState) -> AgentState:
-        """Analyze user intent and determine if tools are needed."""
-        user_message = state["messages"][-1]["content"].lower() if state["messages"] else ""
-        
-        # Gmail intent detection
-        gmail_keywords = {
-            "inbox": ("gmail", "fetch_emails", {}),
-            "email": ("gmail", "fetch_emails", {}),
-            "mail": ("gmail", "fetch_emails", {}),
-            "unread": ("gmail", "get_important_emails", {}),
-            "important emails": ("gmail", "get_important_emails", {}),
-            "send email": ("gmail", "send_email", {}),
-            "reply": ("gmail", "send_email", {}),
-        }
-        
-        # Calendar intent detection
-        calendar_keywords = {
-            "calendar": ("calendar", "get_upcoming_events", {}),
-            "schedule": ("calendar", "get_today_schedule", {}),
-            "today": ("calendar", "get_today_schedule", {}),
-            "meetings": ("calendar", "get_upcoming_events", {}),
-            "events": ("calendar", "get_upcoming_events", {}),
-            "next meeting": ("calendar", "get_next_meeting", {}),
-            "available": ("calendar", "check_availability", {}),
-            "free": ("calendar", "check_availability", {}),
-        }
+    def _analyze_intent(self, user_message: str) -> List[Dict[str, Any]]:
+        """Analyze user intent and return the tool calls it needs, at most one per tool."""
+        # Single scan over the message, keeping the highest-priority keyword per tool
+        best = {}
+        for match in _INTENT_PATTERN.finditer(user_message.lower()):
+            priority = _INTENT_PRIORITY[match.group(0)]
+            tool = _INTENT_KEYWORDS[priority][1]
+            if priority < best.get(tool, len(_INTENT_KEYWORDS)):
+                best[tool] = priority
         
-        # Check for tool matches
-        state["needs_tool"] = False
+        tool_calls = []
+        for priority in sorted(best.values()):
+            _, tool, action = _INTENT_KEYWORDS[priority]
+            tool_calls.append({"tool": tool, "action": action, "params": {}})
+            logger.info(f"Detected {tool.title()} intent: {action}")
         
-        for keyword, (tool, action, params) in gmail_keywords.items():
-            if keyword in user_message:
-                state["needs_tool"] = True
-                state["tool_name"] = tool
-                state["tool_action"] = action
-                state["tool_params"] = params
-                logger.info(f"Detected Gmail intent: {action}")
-                break
-        
-        if not state["needs_tool"]:
-            for keyword, (tool, action, params) in calendar_keywords.items():
-                if keyword in user_message:
-                    state["needs_tool"] = True
-                    state["tool_name"] = tool
-                    state["tool_action"] = action
-                    state["tool_params"] = params
-                    logger.info(f"Detected Calendar intent: {action}")
-                    break
-        
-        return state
+        return tool_calls
     
-    def _should_use_tool(self, state: AgentState) -> str:
-        """Decide if tool execution is needed."""
-        if state.get("needs_tool", False):
-            return "execute_tool"
-        return "generate_response"
-    
-    async def _execute_tool(self, state: AgentState) -> AgentState:
-        """Execute the appropriate tool."""
+    async def _execute_tool(
+        self,
+        user_id: str,
+        session_id: Optional[str],
+        call: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Execute a single tool call."""
+        tool_name = call["tool"]
+        tool_action = call["action"]
         try:
-            tool_name = state.get("tool_name", "")
-            tool_action = state.get("tool_action", "")
-            tool_params = state.get("tool_params", {})
+            tool_func = self.tools.get(tool_name, {}).get(tool_action)
             
-            if tool_name and tool_action:
-                tool_func = self.tools.get(tool_name, {}).get(tool_action)
-                
-                if tool_func:
-                    # Execute the tool
-                    result = await tool_func(
-                        user_id=state["user_id"],
-                        **tool_params
-                    )
-                    state["tool_result"] = result
-                    logger.info(f"Tool {tool_name}.{tool_action} executed successfully")
-                else:
-                    state["tool_result"] = {"error": "Tool not found"}
-                    logger.warning(f"Tool not found: {tool_name}.{tool_action}")
+            if tool_func:
+                # Execute the tool
+                result = await tool_func(
+                    user_id=user_id,
+                    session_id=session_id,
+                    **call.get("params", {})
+                )
+                logger.info(f"Tool {tool_name}.{tool_action} executed successfully")
             else:
-                state["tool_result"] = None
+                result = {"error": "Tool not found"}
+                logger.warning(f"Tool not found: {tool_name}.{tool_action}")
                 
         except Exception as e:
             logger.error(f"Error executing tool: {e}")
-            state["tool_result"] = {"error": str(e)}
+            result = {"error": str(e)}
         
-        return state
+        digest = hashlib.sha256(orjson.dumps(result, default=str, option=orjson.OPT_SORT_KEYS)).hexdigest()
+        return {"tool": tool_name, "action": tool_action, "result": result, "digest": digest}
     
-    async def _generate_response(self, state: AgentState) -> AgentState:
+    async def _generate_response(self, state: AgentState) -> Dict[str, Any]:
         """Generate response using LLM with context."""
         try:
-            messages = []
+            # Serve near-duplicate questions from the semantic cache
+            query_embedding = state.get("query_embedding")
+            cache_key = None
+            if settings.SEMANTIC_CACHE_ENABLED:
+                # Follow-ups depend on the history and on what is remembered, not just the message
+                cache_key = semantic_cache.context_key(
+                    state["user_id"],
+                    ",".join(call["tool"] for call in state.get("tool_calls", [])),
+                    [tool_output["digest"] for tool_output in state.get("tool_results") or []],
+                    {
+                        "history": [(msg["role"], msg["content"]) for msg in state["messages"]],
+                        "memories": [mem.get("id") for mem in state.get("memory_context") or []]
+                    }
+                )
+                cached = semantic_cache.lookup(query_embedding, cache_key)
+                if cached is not None:
+                    logger.info("Response served from semantic cache")
+                    return {"response": cached}
             
-            # Build enhanced system prompt
-            system_prompt = """You are an intelligent AI assistant acting as a personal "Chief of Staff". 
-You help users manage their day by accessing their Gmail and Calendar when needed.
-
-Your capabilities:
-- Read and summarize emails from the user's inbox
-- Check calendar events and schedules
-- Help draft and send email replies
-- Remember user preferences and context
-
-Be concise, professional, and proactive. Provide actionable insights."""
+            # Static instructions first so the provider can reuse the cached prefix
+            messages = [self._system_message]
+            
+            # Add conversation history
+            messages.extend(self._wrap_history(state["messages"]))
+            
+            # Per-turn memory and tool data go last, after the stable prefix
+            context_parts = []
             
             # Add memory context
             if state.get("memory_context"):
@@ -221,45 +312,67 @@ Be concise, professional, and proactive. Provide actionable insights."""
                     f"• {mem['content']} (confidence: {mem['confidence']:.0%})"
                     for mem in state["memory_context"]
                 ])
-                system_prompt += f"\n\n📝 What I remember about you:\n{memory_text}"
+                context_parts.append(f"\n\n📝 What I remember about you:\n{memory_text}")
             
             # Add tool results if available
-            if state.get("tool_result"):
-                result = state["tool_result"]
+            for tool_output in state.get("tool_results") or []:
+                result = tool_output["result"]
+                if not result:
+                    continue
                 if isinstance(result, list):
-                    if result and not result[0].get('error'):
+                    if not result[0].get('error'):
                         # Format tool results
-                        formatted = self._format_tool_results(state["tool_name"], result)
-                        system_prompt += f"\n\n📊 Data retrieved:\n{formatted}"
-                    elif result and result[0].get('error'):
-                        system_prompt += f"\n\n⚠️ Could not access data: {result[0]['error']}"
+                        formatted = self._format_tool_results_cached(
+                            tool_output["tool"], tool_output["digest"], result
+                        )
+                        context_parts.append(f"\n\n📊 Data retrieved:\n{formatted}")
+                    else:
+                        context_parts.append(f"\n\n⚠️ Could not access data: {result[0]['error']}")
                 elif isinstance(result, dict):
                     if result.get('error'):
-                        system_prompt += f"\n\n⚠️ Error: {result['error']}"
+                        context_parts.append(f"\n\n⚠️ Error: {result['error']}")
                     else:
-                        formatted = json.dumps(result, indent=2, default=str)
-                        system_prompt += f"\n\n📊 Data retrieved:\n{formatted}"
+                        formatted = orjson.dumps(result, default=str, option=_JSON_OPTIONS).decode()
+                        context_parts.append(f"\n\n📊 Data retrieved:\n{formatted}")
             
-            messages.append(HumanMessage(content=f"System Instructions: {system_prompt}"))
-            
-            # Add conversation history
-            for msg in state["messages"]:
-                if msg["role"] == "user":
-                    messages.append(HumanMessage(content=msg["content"]))
-                else:
-                    messages.append(AIMessage(content=msg["content"]))
+            if context_parts:
+                messages.append(HumanMessage(content="Context:" + "".join(context_parts)))
             
             # Generate response
             logger.info(f"Generating response with {len(messages)} messages...")
-            response = self.llm.invoke(messages)
-            state["response"] = response.content
+            response = await self.llm.ainvoke(messages)
             logger.info("Response generated successfully")
             
+            if cache_key is not None:
+                semantic_cache.add(query_embedding, cache_key, response.content)
+            
+            return {"response": response.content}
+            
         except Exception as e:
             logger.error(f"Error generating response: {e}", exc_info=True)
-            state["response"] = "I apologize, but I encountered an error processing your request. Please try again."
-        
-        return state
+            return {"response": "I apologize, but I encountered an error processing your request. Please try again."}
+    
+    def _wrap_history(self, history: List[Dict[str, str]]) -> List[BaseMessage]:
+        """Wrap the history window as LangChain messages, reusing the wrappers of stored messages."""
+        wrapped = []
+        for msg in history:
+            # The incoming message is not stored yet, so it has no id and is wrapped afresh
+            message = self._history_cache.get(msg.get("id"))
+            if message is None:
+                message = HumanMessage(content=msg["content"]) if msg["role"] == "user" else AIMessage(content=msg["content"])
+                if msg.get("id"):
+                    self._history_cache[msg["id"]] = message
+            wrapped.append(message)
+        return wrapped
+    
+    def _format_tool_results_cached(self, tool_name: str, digest: str, results: List[Dict]) -> str:
+        """Format tool results, reusing the output for identical results."""
+        cache_key = (tool_name, digest)
+        formatted = self._format_cache.get(cache_key)
+        if formatted is None:
+            formatted = self._format_tool_results(tool_name, results)
+            self._format_cache[cache_key] = formatted
+        return formatted
     
     def _format_tool_results(self, tool_name: str, results: List[Dict]) -> str:
         """Format tool results for the prompt."""
@@ -283,15 +396,15 @@ Be concise, professional, and proactive. Provide actionable insights."""
                 )
             return "\n".join(formatted)
         
-        return json.dumps(results, indent=2, default=str)
+        return orjson.dumps(results, default=str, option=_JSON_OPTIONS).decode()
     
-    async def _extract_memory(self, state: AgentState) -> AgentState:
+    async def _extract_memory(self, messages: List[Dict[str, str]], user_id: str) -> None:
         """Extract and store facts from the conversation."""
         try:
             # Extract facts from conversation
             facts = await memory_brain.extract_facts_from_conversation(
-                messages=state["messages"],
-                user_id=state["user_id"]
+                messages=messages,
+                user_id=user_id
             )
             
             if facts:
@@ -299,35 +412,48 @@ Be concise, professional, and proactive. Provide actionable insights."""
                 
         except Exception as e:
             logger.error(f"Error extracting memory: {e}")
-        
-        return state
+    
+    def _schedule_memory_extraction(self, messages: List[Dict[str, str]], user_id: str) -> None:
+        """Run memory extraction in the background; facts only matter for later turns."""
+        task = asyncio.create_task(self._extract_memory(messages, user_id))
+        # Hold a reference so the task is not garbage collected mid-flight
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
     
     async def process_message(
         self,
         message: str,
         user_id: str,
         conversation_id: str,
-        message_history: List[Dict[str, str]]
+        message_history: List[Dict[str, str]],
+        session_id: Optional[str] = None
     ) -> str:
         """Process a user message and return response."""
+        trivial = _TRIVIAL.fullmatch(message.strip())
+        if trivial:
+            self.trivial_skip_total += 1
+            logger.info(f"Answered trivial message without the graph (trivial_skip_total={self.trivial_skip_total})")
+            return _TRIVIAL_REPLIES[trivial.group(1).lower()]
+        
         try:
             # Prepare initial state
             initial_state = AgentState(
                 messages=message_history + [{"role": "user", "content": message}],
                 user_id=user_id,
+                session_id=session_id,
                 conversation_id=conversation_id,
                 memory_context=[],
                 response="",
+                query_embedding=None,
                 needs_tool=False,
-                tool_name="",
-                tool_action="",
-                tool_params={},
-                tool_result=None
+                tool_calls=[],
+                tool_results=[]
             )
             
             # Run the graph
             final_state = await self.graph.ainvoke(initial_state)
             
+            self._schedule_memory_extraction(final_state["messages"], user_id)
             return final_state["response"]
             
         except Exception as e:
@@ -335,5 +461,7 @@ Be concise, professional, and proactive. Provide actionable insights."""
             return "I apologize, but I encountered an error. Please try again."
 
 
-# Global agent instance
-agent = AgenticAssistant()
+@functools.lru_cache(maxsize=1)
+def get_agent() -> AgenticAssistant:
+    """Get the shared agent, constructing the LLM client on first use."""
+    return AgenticAssistant()
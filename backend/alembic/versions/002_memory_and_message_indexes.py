@@ -0,0 +1,34 @@
+"""memory and message indexes
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-15 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Per-user (and per-category) memory retrieval
+    op.create_index('ix_memory_entries_user_cat', 'memory_entries', ['user_id', 'category'])
+    # Rows are appended in created_at order, so a BRIN index stays tiny
+    op.create_index(
+        'ix_memory_entries_created_at_brin', 'memory_entries', ['created_at'],
+        postgresql_using='brin'
+    )
+
+    # Conversation history is always read in created_at order
+    op.create_index('ix_messages_conv_created', 'messages', ['conversation_id', 'created_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_conv_created', 'messages')
+    op.drop_index('ix_memory_entries_created_at_brin', 'memory_entries')
+    op.drop_index('ix_memory_entries_user_cat', 'memory_entries')
@@ -0,0 +1,32 @@
+"""add memory embeddings
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-15 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from pgvector.sqlalchemy import Vector
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector")
+
+    # all-MiniLM-L6-v2 embeddings of memory content
+    op.add_column('memory_entries', sa.Column('embedding', Vector(384), nullable=True))
+    op.execute(
+        "CREATE INDEX ix_memory_entries_embedding ON memory_entries "
+        "USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_memory_entries_embedding', 'memory_entries')
+    op.drop_column('memory_entries', 'embedding')
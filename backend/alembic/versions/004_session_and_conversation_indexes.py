@@ -0,0 +1,30 @@
+"""session and conversation indexes
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-15 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Tool calls look up a user's latest session
+    op.create_index('ix_sessions_user_created', 'sessions', ['user_id', sa.text('created_at DESC')])
+
+    # Conversation lists are per user, most recently updated first
+    op.create_index(
+        'ix_conversations_user_updated', 'conversations', ['user_id', sa.text('updated_at DESC')]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_conversations_user_updated', 'conversations')
+    op.drop_index('ix_sessions_user_created', 'sessions')
@@ -0,0 +1,35 @@
+"""memory metadata defaults and GIN index
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-15 13:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("UPDATE memory_entries SET metadata = '{}'::jsonb WHERE metadata IS NULL")
+    op.alter_column(
+        'memory_entries', 'metadata',
+        nullable=False,
+        server_default=sa.text("'{}'::jsonb")
+    )
+
+    # Containment lookups (metadata @> '{"k": "v"}') on learned memories
+    op.create_index(
+        'ix_memory_entries_metadata', 'memory_entries', ['metadata'],
+        postgresql_using='gin'
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_memory_entries_metadata', 'memory_entries')
+    op.alter_column('memory_entries', 'metadata', nullable=True, server_default=None)
@@ -0,0 +1,37 @@
+"""server-side timestamp defaults
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-15 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+TIMESTAMP_COLUMNS = [
+    ('users', 'created_at'),
+    ('users', 'updated_at'),
+    ('sessions', 'created_at'),
+    ('conversations', 'created_at'),
+    ('conversations', 'updated_at'),
+    ('messages', 'created_at'),
+    ('memory_entries', 'created_at'),
+    ('memory_entries', 'updated_at'),
+]
+
+
+def upgrade() -> None:
+    # Naive UTC, matching the values the application used to send
+    for table, column in TIMESTAMP_COLUMNS:
+        op.alter_column(table, column, server_default=sa.text("timezone('utc', now())"))
+
+
+def downgrade() -> None:
+    for table, column in TIMESTAMP_COLUMNS:
+        op.alter_column(table, column, server_default=None)
@@ -0,0 +1,29 @@
+"""message full-text search
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-15 14:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'messages',
+        sa.Column('content_tsv', TSVECTOR, sa.Computed("to_tsvector('english', content)", persisted=True))
+    )
+    op.create_index('ix_messages_content_tsv', 'messages', ['content_tsv'], postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_content_tsv', 'messages')
+    op.drop_column('messages', 'content_tsv')
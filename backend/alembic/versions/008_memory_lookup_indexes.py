@@ -0,0 +1,41 @@
+"""memory lookup indexes
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-15 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Duplicate checks match on content; hashed so long messages stay under the B-tree row limit
+    op.create_index(
+        'ix_memory_entries_user_content_md5', 'memory_entries', ['user_id', sa.text('md5(content)')]
+    )
+
+    # Retrieval filters by category and reads in confidence/recency order
+    op.create_index(
+        'ix_memory_entries_user_cat_conf_upd', 'memory_entries',
+        ['user_id', 'category', sa.text('confidence DESC'), sa.text('updated_at DESC')]
+    )
+    op.drop_index('ix_memory_entries_user_cat', 'memory_entries')
+
+    # The memory list is per user, most recently updated first
+    op.create_index(
+        'ix_memory_entries_user_updated', 'memory_entries', ['user_id', sa.text('updated_at DESC')]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_memory_entries_user_updated', 'memory_entries')
+    op.create_index('ix_memory_entries_user_cat', 'memory_entries', ['user_id', 'category'])
+    op.drop_index('ix_memory_entries_user_cat_conf_upd', 'memory_entries')
+    op.drop_index('ix_memory_entries_user_content_md5', 'memory_entries')
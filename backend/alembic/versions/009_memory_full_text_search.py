@@ -0,0 +1,29 @@
+"""memory full-text search
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-15 15:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+# revision identifiers, used by Alembic.
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'memory_entries',
+        sa.Column('content_tsv', TSVECTOR, sa.Computed("to_tsvector('english', content)", persisted=True))
+    )
+    op.create_index('ix_memory_entries_content_tsv', 'memory_entries', ['content_tsv'], postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_memory_entries_content_tsv', 'memory_entries')
+    op.drop_column('memory_entries', 'content_tsv')
@@ -0,0 +1,40 @@
+"""unique memory content per user
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-15 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Concurrent writers could store the same fact twice; keep the most confident copy
+    op.execute("""
+        DELETE FROM memory_entries a
+        USING memory_entries b
+        WHERE a.user_id = b.user_id
+          AND a.content = b.content
+          AND (a.confidence, a.id) < (b.confidence, b.id)
+    """)
+
+    # store_facts upserts against this index with ON CONFLICT
+    op.drop_index('ix_memory_entries_user_content_md5', 'memory_entries')
+    op.create_index(
+        'ix_memory_entries_user_content_md5', 'memory_entries', ['user_id', sa.text('md5(content)')],
+        unique=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_memory_entries_user_content_md5', 'memory_entries')
+    op.create_index(
+        'ix_memory_entries_user_content_md5', 'memory_entries', ['user_id', sa.text('md5(content)')]
+    )
@@ -3,66 +3,214 @@ Authentication module for Google OAuth 2.0 and session management.
 """
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import RedirectResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from sqlalchemy import bindparam, select
 from sqlalchemy.orm import Session
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
 from google_auth_oauthlib.flow import Flow
 from cryptography.fernet import Fernet
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from typing import Optional, Tuple
 from jose import JWTError, jwt
+from cachetools import TTLCache
+from weakref import WeakValueDictionary
+import asyncio
+import threading
+import hashlib
 import base64
 import logging
+import time
+import uuid
 
-from config import settings
-from database import get_db, User, Session as DBSession
+import httpx
+
+from config import Settings, get_settings, settings
+from database import get_db, use_session, User, Session as DBSession
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-# Encryption for tokens
-def get_cipher():
-    """Get Fernet cipher for token encryption."""
-    key = base64.urlsafe_b64encode(settings.SECRET_KEY.encode()[:32].ljust(32, b'0'))
-    return Fernet(key)
+GOOGLE_TOKEN_URI = "https://oauth2.googleapis.com/token"
+
+# Encryption for tokens, derived from SECRET_KEY once at import
+_cipher = Fernet(base64.urlsafe_b64encode(settings.SECRET_KEY.encode()[:32].ljust(32, b'0')))
 
 
 def encrypt_token(token: str) -> str:
     """Encrypt a token."""
-    cipher = get_cipher()
-    return cipher.encrypt(token.encode()).decode()
+    return _cipher.encrypt(token.encode()).decode()
 
 
 def decrypt_token(encrypted_token: str) -> str:
     """Decrypt a token."""
-    cipher = get_cipher()
-    return cipher.decrypt(encrypted_token.encode()).decode()
+    return _cipher.decrypt(encrypted_token.encode()).decode()
+
+
+def encrypt_bytes(data: bytes) -> bytes:
+    """Encrypt arbitrary data, such as a file written to disk."""
+    return _cipher.encrypt(data)
+
+
+def decrypt_bytes(data: bytes) -> bytes:
+    """Decrypt data produced by encrypt_bytes()."""
+    return _cipher.decrypt(data)
+
+
+async def refresh_access_token(client: httpx.AsyncClient, refresh_token_encrypted: str) -> str:
+    """Exchange a stored refresh token for a new Google access token."""
+    refresh_token = decrypt_token(refresh_token_encrypted)
+    if not refresh_token:
+        raise ValueError("No refresh token stored for session")
+    
+    response = await client.post(GOOGLE_TOKEN_URI, data={
+        "client_id": settings.GOOGLE_CLIENT_ID,
+        "client_secret": settings.GOOGLE_CLIENT_SECRET,
+        "refresh_token": refresh_token,
+        "grant_type": "refresh_token"
+    })
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+# Built once; the bound parameter keeps it a single compiled-cache entry
+_LATEST_SESSION = select(DBSession).where(
+    DBSession.user_id == bindparam("user_id")
+).order_by(DBSession.created_at.desc()).limit(1)
+
+
+def get_user_session(db: Session, user_id: str, session_id: Optional[str] = None) -> DBSession:
+    """Get a user's stored Google session, by primary key when the JWT carries its id."""
+    if session_id:
+        session = db.get(DBSession, uuid.UUID(session_id))
+        if not session or str(session.user_id) != str(user_id):
+            raise ValueError(f"Session {session_id} not found for user {user_id}")
+        return session
+    
+    # Tokens issued without a session id fall back to the user's latest session
+    session = db.scalars(_LATEST_SESSION, {"user_id": user_id}).first()
+    
+    if not session:
+        raise ValueError(f"No active session for user {user_id}")
+    
+    return session
+
+
+def load_session_tokens(
+    db: Optional[Session],
+    user_id: str,
+    session_id: Optional[str] = None
+) -> Tuple[uuid.UUID, str, str]:
+    """Load a stored session's id and encrypted (access, refresh) tokens, holding a connection only for the query."""
+    with use_session(db) as db:
+        session = get_user_session(db, user_id, session_id)
+        return session.id, session.access_token_encrypted, session.refresh_token_encrypted
+
+
+def store_access_token(db: Optional[Session], session_pk: uuid.UUID, access_token: str) -> None:
+    """Encrypt and store a refreshed access token on its session."""
+    with use_session(db) as db:
+        db.query(DBSession).filter(DBSession.id == session_pk).update(
+            {DBSession.access_token_encrypted: encrypt_token(access_token)}
+        )
+        db.commit()
+
+
+class GoogleAccessTokens:
+    """Decrypted Google access tokens per (user_id, session_id), refreshed once however many calls get a 401."""
+    
+    def __init__(self):
+        """Initialize the token cache."""
+        self._cache = TTLCache(maxsize=1024, ttl=300)
+        # One lock per (user_id, session_id) so concurrent 401s refresh the token once; dropped when unused
+        self._locks: WeakValueDictionary = WeakValueDictionary()
+    
+    async def get(
+        self,
+        client: httpx.AsyncClient,
+        user_id: str,
+        session_id: Optional[str],
+        db: Optional[Session],
+        stale: Optional[str] = None
+    ) -> str:
+        """
+        Get the user's Google access token, refreshing it once if it is the stale one that got a 401.
+        
+        Args:
+            client: HTTP client to send a refresh request with
+            user_id: The user's ID
+            session_id: Session id from the JWT, if it carries one
+            db: Optional request-scoped session; a new one is opened per query if omitted
+            stale: Access token a request was just rejected with
+        
+        Returns:
+            A decrypted access token other than the stale one
+        """
+        cache_key = (user_id, session_id)
+        access_token = self._cache.get(cache_key)
+        if access_token is not None and access_token != stale:
+            return access_token
+        
+        async with self._locks.setdefault(cache_key, asyncio.Lock()):
+            # Another call may have loaded or refreshed the token while this one waited
+            access_token = self._cache.get(cache_key)
+            if access_token is not None and access_token != stale:
+                return access_token
+            
+            # The database is only touched in short blocking calls, never across an HTTP round trip
+            try:
+                session_pk, access_encrypted, refresh_encrypted = await asyncio.to_thread(
+                    load_session_tokens, db, user_id, session_id
+                )
+            except Exception as e:
+                logger.error(f"Error getting Google credentials: {e}")
+                raise
+            
+            access_token = decrypt_token(access_encrypted)
+            if access_token == stale:
+                # The refresh token is only decrypted once the access token has expired
+                access_token = await refresh_access_token(client, refresh_encrypted)
+                await asyncio.to_thread(store_access_token, db, session_pk, access_token)
+            
+            self._cache[cache_key] = access_token
+            return access_token
+
+
+# OAuth flow configuration, built once; each request still gets its own Flow for its state
+_OAUTH_CLIENT_CONFIG = {
+    "web": {
+        "client_id": settings.GOOGLE_CLIENT_ID,
+        "client_secret": settings.GOOGLE_CLIENT_SECRET,
+        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+        "token_uri": GOOGLE_TOKEN_URI,
+        "redirect_uris": [settings.GOOGLE_REDIRECT_URI]
+    }
+}
+_OAUTH_SCOPES = [
+    "openid",
+    "https://www.googleapis.com/auth/userinfo.email",
+    "https://www.googleapis.com/auth/userinfo.profile",
+    "https://www.googleapis.com/auth/gmail.readonly",
+    "https://www.googleapis.com/auth/gmail.compose",
+    "https://www.googleapis.com/auth/calendar.readonly"
+]
 
 
-# OAuth flow configuration
 def get_oauth_flow():
     """Create OAuth flow for Google authentication."""
     return Flow.from_client_config(
-        {
-            "web": {
-                "client_id": settings.GOOGLE_CLIENT_ID,
-                "client_secret": settings.GOOGLE_CLIENT_SECRET,
-                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                "token_uri": "https://oauth2.googleapis.com/token",
-                "redirect_uris": [settings.GOOGLE_REDIRECT_URI]
-            }
-        },
-        scopes=[
-            "openid",
-            "https://www.googleapis.com/auth/userinfo.email",
-            "https://www.googleapis.com/auth/userinfo.profile",
-            "https://www.googleapis.com/auth/gmail.readonly",
-            "https://www.googleapis.com/auth/gmail.compose",
-            "https://www.googleapis.com/auth/calendar.readonly"
-        ],
+        _OAUTH_CLIENT_CONFIG,
+        scopes=_OAUTH_SCOPES,
         redirect_uri=settings.GOOGLE_REDIRECT_URI
     )
 
 
+# Decoded JWT payloads keyed by sha256 of the token; failures are never cached
+_token_cache = TTLCache(maxsize=10000, ttl=30)
+_token_cache_lock = threading.Lock()
+
+
 def create_access_token(data: dict) -> str:
     """Create JWT access token."""
     to_encode = data.copy()
@@ -73,14 +221,53 @@ def create_access_token(data: dict) -> str:
 
 def verify_token(token: str) -> dict:
     """Verify JWT token and return payload."""
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    # Reuse recently decoded payloads, but never past their expiry
+    cache_key = hashlib.sha256(token.encode()).digest()
+    with _token_cache_lock:
+        payload = _token_cache.get(cache_key)
+    if payload is not None and payload.get("exp", 0) > time.time():
         return payload
+    
+    try:
+        payload = jwt.decode(
+            token,
+            settings.SECRET_KEY,
+            algorithms=[settings.ALGORITHM],
+            options={"require_exp": True, "require_sub": True}
+        )
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials"
         )
+    
+    with _token_cache_lock:
+        _token_cache[cache_key] = payload
+    return payload
+
+
+# Parses "Authorization: Bearer <token>" and rejects requests without it
+_bearer = HTTPBearer()
+
+
+@dataclass(frozen=True)
+class AuthContext:
+    """Identity carried by a verified access token."""
+    user_id: str
+    session_id: Optional[str]
+    email: Optional[str]
+
+
+async def get_auth_context(
+    credentials: HTTPAuthorizationCredentials = Depends(_bearer)
+) -> AuthContext:
+    """Dependency that verifies the bearer token once per request."""
+    payload = verify_token(credentials.credentials)
+    return AuthContext(
+        user_id=payload["sub"],
+        session_id=payload.get("session_id"),
+        email=payload.get("email")
+    )
 
 
 @router.post("/login")
@@ -103,7 +290,12 @@ async def login():
 
 
 @router.get("/callback")
-async def auth_callback(code: str, state: str, db: Session = Depends(get_db)):
+async def auth_callback(
+    code: str,
+    state: str,
+    db: Session = Depends(get_db),
+    app_settings: Settings = Depends(get_settings)
+):
     """Handle OAuth callback from Google."""
     try:
         # Exchange code for tokens
@@ -140,7 +332,6 @@ async def auth_callback(code: str, state: str, db: Session = Depends(get_db)):
             # Update user info
             user.email = email
             user.name = name
-            user.updated_at = datetime.utcnow()
             db.commit()
             logger.info(f"User logged in: {email}")
         
@@ -167,12 +358,12 @@ async def auth_callback(code: str, state: str, db: Session = Depends(get_db)):
         })
         
         # Redirect to frontend with token
-        redirect_url = f"{settings.FRONTEND_URL}/auth/callback?token={jwt_token}"
+        redirect_url = f"{app_settings.FRONTEND_URL}/auth/callback?token={jwt_token}"
         return RedirectResponse(url=redirect_url)
         
     except Exception as e:
         logger.error(f"Auth callback error: {e}", exc_info=True)
-        error_url = f"{settings.FRONTEND_URL}/auth/error?message=Authentication failed"
+        error_url = f"{app_settings.FRONTEND_URL}/auth/error?message=Authentication failed"
         return RedirectResponse(url=error_url)
 
 
@@ -206,7 +397,7 @@ async def auth_status(token: str, db: Session = Depends(get_db)):
         payload = verify_token(token)
         user_id = payload.get("sub")
         
-        user = db.query(User).filter(User.id == user_id).first()
+        user = db.get(User, uuid.UUID(user_id))
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -229,12 +420,12 @@ async def auth_status(token: str, db: Session = Depends(get_db)):
 
 
 # Dependency for getting current user
-async def get_current_user(token: str, db: Session = Depends(get_db)) -> User:
+async def get_current_user(
+    auth: AuthContext = Depends(get_auth_context),
+    db: Session = Depends(get_db)
+) -> User:
     """Get current authenticated user."""
-    payload = verify_token(token)
-    user_id = payload.get("sub")
-    
-    user = db.query(User).filter(User.id == user_id).first()
+    user = db.get(User, uuid.UUID(auth.user_id))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
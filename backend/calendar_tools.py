@@ -2,66 +2,105 @@
 Google Calendar integration tools for the AI assistant.
 Provides functionality to view, create, and manage calendar events.
 """
-from typing import List, Dict, Any, Optional
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
+from typing import List, Dict, Any, Optional, Tuple
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import logging
 
-from database import SessionLocal, User, Session as DBSession
-from auth import decrypt_token
+import httpx
+import numpy as np
+
+from auth import GoogleAccessTokens
 
 logger = logging.getLogger(__name__)
 
+EVENTS_URL = "https://www.googleapis.com/calendar/v3/calendars/primary/events"
+
+
+def find_free_slots(busy: np.ndarray, window_seconds: int, min_seconds: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the gaps between busy intervals inside a window.
+    
+    Args:
+        busy: (N, 2) int64 array of busy (start, end) offsets in seconds
+        window_seconds: Length of the window in seconds
+        min_seconds: Shortest gap to report
+    
+    Returns:
+        Start and end offsets of the free slots, in order
+    """
+    busy = busy[np.argsort(busy[:, 0], kind='stable')]
+    
+    # A gap starts once every earlier meeting has ended and runs until the next one starts
+    slot_starts = np.maximum.accumulate(np.concatenate(([0], busy[:, 1])))
+    slot_ends = np.concatenate((busy[:, 0], [window_seconds]))
+    
+    keep = slot_ends - slot_starts >= min_seconds
+    return slot_starts[keep], slot_ends[keep]
+
 
 class CalendarTools:
     """Google Calendar API tools for the agent."""
     
     def __init__(self):
         """Initialize Calendar tools."""
-        self.scopes = ['https://www.googleapis.com/auth/calendar.readonly']
+        self._tokens = GoogleAccessTokens()
+        self._client: Optional[httpx.AsyncClient] = None
     
-    def _get_calendar_service(self, user_id: str, db: Session):
-        """Get authenticated Calendar service for a user."""
-        try:
-            # Get user session with stored tokens
-            user = db.query(User).filter(User.id == user_id).first()
-            if not user:
-                raise ValueError(f"User {user_id} not found")
-            
-            session = db.query(DBSession).filter(
-                DBSession.user_id == user_id
-            ).order_by(DBSession.created_at.desc()).first()
-            
-            if not session:
-                raise ValueError(f"No active session for user {user_id}")
-            
-            # Decrypt access token
-            access_token = decrypt_token(session.access_token_encrypted)
-            refresh_token = decrypt_token(session.refresh_token_encrypted)
-            
-            # Create credentials
-            credentials = Credentials(
-                token=access_token,
-                refresh_token=refresh_token,
-                token_uri='https://oauth2.googleapis.com/token',
-                scopes=self.scopes
-            )
-            
-            # Build Calendar service
-            service = build('calendar', 'v3', credentials=credentials)
-            return service
-            
-        except Exception as e:
-            logger.error(f"Error getting Calendar service: {e}")
-            raise
+    def _get_client(self) -> httpx.AsyncClient:
+        """Get the shared HTTP client, creating it on first use."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=10)
+        return self._client
+    
+    async def aclose(self) -> None:
+        """Close the shared HTTP client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def _get_access_token(
+        self,
+        user_id: str,
+        session_id: Optional[str],
+        db: Optional[Session],
+        stale: Optional[str] = None
+    ) -> str:
+        """Get the user's Google access token, refreshing it once if it is the stale one that got a 401."""
+        return await self._tokens.get(self._get_client(), user_id, session_id, db, stale)
+    
+    async def _list_events(
+        self,
+        user_id: str,
+        session_id: Optional[str],
+        db: Optional[Session],
+        **params
+    ) -> List[Dict[str, Any]]:
+        """List events on the user's primary calendar."""
+        access_token = await self._get_access_token(user_id, session_id, db)
+        response = await self._get_events(access_token, params)
+        if response.status_code == 401:
+            access_token = await self._get_access_token(user_id, session_id, db, stale=access_token)
+            response = await self._get_events(access_token, params)
+        
+        response.raise_for_status()
+        return response.json().get('items', [])
+    
+    async def _get_events(self, access_token: str, params: Dict[str, Any]) -> httpx.Response:
+        """Send an events list request."""
+        return await self._get_client().get(
+            EVENTS_URL,
+            params=params,
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
     
     async def get_upcoming_events(
         self, 
         user_id: str, 
         days: int = 7,
-        max_results: int = 20
+        max_results: int = 20,
+        session_id: Optional[str] = None,
+        db: Optional[Session] = None
     ) -> List[Dict[str, Any]]:
         """
         Get upcoming calendar events for the next N days.
@@ -70,45 +109,47 @@ class CalendarTools:
             user_id: The user's ID
             days: Number of days to look ahead
             max_results: Maximum number of events
+            session_id: Optional session ID from the caller's JWT
+            db: Optional request-scoped session, used only to load credentials
         
         Returns:
             List of upcoming events
         """
-        db = SessionLocal()
         try:
-            service = self._get_calendar_service(user_id, db)
-            
             # Calculate time range
             now = datetime.utcnow()
             time_min = now.isoformat() + 'Z'
             time_max = (now + timedelta(days=days)).isoformat() + 'Z'
             
             # Get events
-            events_result = service.events().list(
-                calendarId='primary',
+            events = await self._list_events(
+                user_id,
+                session_id,
+                db,
                 timeMin=time_min,
                 timeMax=time_max,
                 maxResults=max_results,
                 singleEvents=True,
                 orderBy='startTime'
-            ).execute()
-            
-            events = events_result.get('items', [])
+            )
             
             formatted_events = []
+            append = formatted_events.append
             for event in events:
-                start = event['start'].get('dateTime', event['start'].get('date'))
-                end = event['end'].get('dateTime', event['end'].get('date'))
+                event_start = event['start']
+                event_end = event['end']
+                description = event.get('description')
+                attendees = event.get('attendees')
                 
-                formatted_events.append({
+                append({
                     'id': event['id'],
                     'title': event.get('summary', '(No title)'),
-                    'start': start,
-                    'end': end,
+                    'start': event_start.get('dateTime') or event_start.get('date'),
+                    'end': event_end.get('dateTime') or event_end.get('date'),
                     'location': event.get('location', ''),
-                    'description': event.get('description', '')[:200] if event.get('description') else '',
-                    'attendees': [a.get('email') for a in event.get('attendees', [])][:5],
-                    'is_all_day': 'date' in event['start']
+                    'description': description[:200] if description else '',
+                    'attendees': [a.get('email') for a in attendees[:5]] if attendees else [],
+                    'is_all_day': 'date' in event_start
                 })
             
             logger.info(f"Fetched {len(formatted_events)} events for user {user_id}")
@@ -117,23 +158,25 @@ class CalendarTools:
         except Exception as e:
             logger.error(f"Error fetching calendar events: {e}")
             return [{"error": str(e)}]
-        finally:
-            db.close()
     
-    async def get_today_schedule(self, user_id: str) -> List[Dict[str, Any]]:
+    async def get_today_schedule(
+        self,
+        user_id: str,
+        session_id: Optional[str] = None,
+        db: Optional[Session] = None
+    ) -> List[Dict[str, Any]]:
         """
         Get today's calendar events.
         
         Args:
             user_id: The user's ID
+            session_id: Optional session ID from the caller's JWT
+            db: Optional request-scoped session, used only to load credentials
         
         Returns:
             List of today's events
         """
-        db = SessionLocal()
         try:
-            service = self._get_calendar_service(user_id, db)
-            
             # Today's time range
             now = datetime.utcnow()
             start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -142,15 +185,15 @@ class CalendarTools:
             time_min = start_of_day.isoformat() + 'Z'
             time_max = end_of_day.isoformat() + 'Z'
             
-            events_result = service.events().list(
-                calendarId='primary',
+            events = await self._list_events(
+                user_id,
+                session_id,
+                db,
                 timeMin=time_min,
                 timeMax=time_max,
                 singleEvents=True,
                 orderBy='startTime'
-            ).execute()
-            
-            events = events_result.get('items', [])
+            )
             
             formatted_events = []
             for event in events:
@@ -171,14 +214,14 @@ class CalendarTools:
         except Exception as e:
             logger.error(f"Error fetching today's schedule: {e}")
             return [{"error": str(e)}]
-        finally:
-            db.close()
     
     async def check_availability(
         self, 
         user_id: str, 
         date: str,
-        duration_minutes: int = 60
+        duration_minutes: int = 60,
+        session_id: Optional[str] = None,
+        db: Optional[Session] = None
     ) -> Dict[str, Any]:
         """
         Check free time slots on a specific date.
@@ -187,14 +230,13 @@ class CalendarTools:
             user_id: The user's ID
             date: Date to check (YYYY-MM-DD format)
             duration_minutes: Desired meeting duration
+            session_id: Optional session ID from the caller's JWT
+            db: Optional request-scoped session, used only to load credentials
         
         Returns:
             Available time slots
         """
-        db = SessionLocal()
         try:
-            service = self._get_calendar_service(user_id, db)
-            
             # Parse date and set time range
             target_date = datetime.strptime(date, '%Y-%m-%d')
             start_of_day = target_date.replace(hour=9, minute=0)  # 9 AM
@@ -204,44 +246,41 @@ class CalendarTools:
             time_max = end_of_day.isoformat() + 'Z'
             
             # Get existing events
-            events_result = service.events().list(
-                calendarId='primary',
+            events = await self._list_events(
+                user_id,
+                session_id,
+                db,
                 timeMin=time_min,
                 timeMax=time_max,
                 singleEvents=True,
                 orderBy='startTime'
-            ).execute()
-            
-            events = events_result.get('items', [])
+            )
             
-            # Calculate busy times
-            busy_times = []
-            for event in events:
-                if 'dateTime' in event['start']:
-                    start = datetime.fromisoformat(event['start']['dateTime'].replace('Z', '+00:00'))
-                    end = datetime.fromisoformat(event['end']['dateTime'].replace('Z', '+00:00'))
-                    busy_times.append((start, end))
+            # Busy intervals as seconds since the start of the window (which is UTC)
+            window_start = start_of_day.replace(tzinfo=timezone.utc)
+            busy = np.array([
+                (
+                    (datetime.fromisoformat(event['start']['dateTime'].replace('Z', '+00:00')) - window_start).total_seconds(),
+                    (datetime.fromisoformat(event['end']['dateTime'].replace('Z', '+00:00')) - window_start).total_seconds()
+                )
+                for event in events
+                if 'dateTime' in event['start']
+            ], dtype=np.int64).reshape(-1, 2)
             
             # Find free slots
-            free_slots = []
-            current_time = start_of_day
-            
-            for busy_start, busy_end in sorted(busy_times):
-                if current_time + timedelta(minutes=duration_minutes) <= busy_start:
-                    free_slots.append({
-                        'start': current_time.strftime('%H:%M'),
-                        'end': busy_start.strftime('%H:%M'),
-                        'duration_minutes': int((busy_start - current_time).total_seconds() / 60)
-                    })
-                current_time = max(current_time, busy_end)
-            
-            # Check remaining time
-            if current_time + timedelta(minutes=duration_minutes) <= end_of_day:
-                free_slots.append({
-                    'start': current_time.strftime('%H:%M'),
-                    'end': end_of_day.strftime('%H:%M'),
-                    'duration_minutes': int((end_of_day - current_time).total_seconds() / 60)
-                })
+            slot_starts, slot_ends = find_free_slots(
+                busy,
+                int((end_of_day - start_of_day).total_seconds()),
+                duration_minutes * 60
+            )
+            free_slots = [
+                {
+                    'start': (start_of_day + timedelta(seconds=int(slot_start))).strftime('%H:%M'),
+                    'end': (start_of_day + timedelta(seconds=int(slot_end))).strftime('%H:%M'),
+                    'duration_minutes': int(slot_end - slot_start) // 60
+                }
+                for slot_start, slot_end in zip(slot_starts, slot_ends)
+            ]
             
             return {
                 'date': date,
@@ -252,30 +291,36 @@ class CalendarTools:
         except Exception as e:
             logger.error(f"Error checking availability: {e}")
             return {"error": str(e)}
-        finally:
-            db.close()
     
-    async def get_next_meeting(self, user_id: str) -> Optional[Dict[str, Any]]:
+    async def get_next_meeting(
+        self,
+        user_id: str,
+        session_id: Optional[str] = None,
+        db: Optional[Session] = None
+    ) -> Optional[Dict[str, Any]]:
         """
         Get the user's next upcoming meeting.
         
         Args:
             user_id: The user's ID
+            session_id: Optional session ID from the caller's JWT
+            db: Optional request-scoped session, used only to load credentials
         
         Returns:
             Next meeting details or None
         """
-        events = await self.get_upcoming_events(user_id, days=1, max_results=5)
+        events = await self.get_upcoming_events(user_id, days=1, max_results=5, session_id=session_id, db=db)
         
         if events and not events[0].get('error'):
-            now = datetime.utcnow()
+            # Timed events carry an offset, so compare against an aware now
+            now = datetime.now(timezone.utc)
             for event in events:
                 if not event.get('is_all_day'):
                     try:
                         start_time = datetime.fromisoformat(event['start'].replace('Z', '+00:00'))
                         if start_time > now:
                             return event
-                    except:
+                    except (KeyError, ValueError):
                         pass
         
         return None
@@ -1,17 +1,21 @@
 """
 Chat endpoints for conversation management.
 """
-from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime
+import asyncio
 import logging
 import uuid
 
-from database import get_db, User, Conversation, Message
-from auth import get_current_user, verify_token
-from agent import agent
+from config import Settings, get_settings
+from database import get_db, search_messages, utc_now, User, Conversation, Message
+from auth import AuthContext, get_auth_context
+from agent import get_agent
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -47,83 +51,90 @@ class ConversationHistoryResponse(BaseModel):
 @router.post("/message", response_model=ChatResponse)
 async def send_message(
     request: ChatRequest,
-    authorization: str = Header(...),
-    db: Session = Depends(get_db)
+    auth: AuthContext = Depends(get_auth_context),
+    db: Session = Depends(get_db),
+    app_settings: Settings = Depends(get_settings)
 ):
     """Send a message and get agent response."""
     try:
-        # Extract token from Authorization header
-        token = authorization.replace("Bearer ", "")
-        
-        # Verify token and get user
-        payload = verify_token(token)
-        user_id = payload.get("sub")
-        
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
+        user_id = auth.user_id
         
-        # Get or create conversation
+        # Get or create conversation; the ownership filter doubles as the user check
         if request.conversation_id:
             conversation = db.query(Conversation).filter(
                 Conversation.id == request.conversation_id,
-                Conversation.user_id == user.id
+                Conversation.user_id == user_id
             ).first()
             if not conversation:
                 raise HTTPException(status_code=404, detail="Conversation not found")
         else:
+            user = db.get(User, uuid.UUID(user_id))
+            if not user:
+                raise HTTPException(status_code=404, detail="User not found")
+            
+            # Flushed only; committed together with the user message below
             conversation = Conversation(user_id=user.id)
             db.add(conversation)
-            db.commit()
-            db.refresh(conversation)
+            db.flush()
             logger.info(f"Created new conversation: {conversation.id}")
         
-        # Save user message
+        # Read the id up front, since committing expires the loaded objects
+        conversation_id = str(conversation.id)
+        
+        # Get the most recent history window before adding the new message
+        recent = db.query(Message.id, Message.role, Message.content).filter(
+            Message.conversation_id == conversation_id
+        ).order_by(Message.created_at.desc()).limit(app_settings.HISTORY_WINDOW).all()
+        
+        message_history = [
+            {"id": str(message_id), "role": role, "content": content}
+            for message_id, role, content in reversed(recent)
+        ]
+        
+        # Save user message, committed separately so it survives an agent failure
         user_message = Message(
-            conversation_id=conversation.id,
+            conversation_id=conversation_id,
             role="user",
             content=request.message
         )
-        db.add(user_message)
-        db.commit()
         
-        # Get message history
-        messages = db.query(Message).filter(
-            Message.conversation_id == conversation.id
-        ).order_by(Message.created_at).all()
-        
-        message_history = [
-            {"role": msg.role, "content": msg.content}
-            for msg in messages[:-1]  # Exclude the just-added message
-        ]
+        def save_user_message():
+            db.add(user_message)
+            db.commit()
         
-        # Process message with agent
-        response_text = await agent.process_message(
-            message=request.message,
-            user_id=str(user.id),
-            conversation_id=str(conversation.id),
-            message_history=message_history
+        # The agent works from message_history, so persist and process concurrently
+        _, response_text = await asyncio.gather(
+            run_in_threadpool(save_user_message),
+            get_agent().process_message(
+                message=request.message,
+                user_id=user_id,
+                conversation_id=conversation_id,
+                message_history=message_history,
+                session_id=auth.session_id
+            )
         )
         
-        # Save assistant response
+        # Save assistant response with a client-side id so no refresh is needed
+        message_id = uuid.uuid4()
         assistant_message = Message(
-            conversation_id=conversation.id,
+            id=message_id,
+            conversation_id=conversation_id,
             role="assistant",
             content=response_text
         )
         db.add(assistant_message)
         
-        # Update conversation timestamp
-        conversation.updated_at = datetime.utcnow()
+        # Update conversation timestamp; nothing else changes, so onupdate would not fire
+        conversation.updated_at = utc_now
         db.commit()
-        db.refresh(assistant_message)
         
-        logger.info(f"Message processed for conversation {conversation.id}")
+        logger.info(f"Message processed for conversation {conversation_id}")
         
-        return ChatResponse(
+        # Server-built response, so skip validation
+        return ChatResponse.model_construct(
             response=response_text,
-            conversation_id=str(conversation.id),
-            message_id=str(assistant_message.id)
+            conversation_id=conversation_id,
+            message_id=str(message_id)
         )
         
     except HTTPException:
@@ -139,32 +150,30 @@ async def send_message(
 @router.get("/history/{conversation_id}", response_model=ConversationHistoryResponse)
 async def get_conversation_history(
     conversation_id: str,
-    authorization: str = Header(...),
+    auth: AuthContext = Depends(get_auth_context),
     db: Session = Depends(get_db)
 ):
     """Get conversation history."""
     try:
-        # Extract token and verify user
-        token = authorization.replace("Bearer ", "")
-        payload = verify_token(token)
-        user_id = payload.get("sub")
-        
         # Get conversation
         conversation = db.query(Conversation).filter(
             Conversation.id == conversation_id,
-            Conversation.user_id == user_id
+            Conversation.user_id == auth.user_id
         ).first()
         
         if not conversation:
             raise HTTPException(status_code=404, detail="Conversation not found")
         
-        # Get messages
-        messages = db.query(Message).filter(
+        # Get messages as plain column rows, skipping ORM object hydration
+        messages = db.query(
+            Message.id, Message.role, Message.content, Message.created_at
+        ).filter(
             Message.conversation_id == conversation.id
         ).order_by(Message.created_at).all()
         
+        # Rows come straight from the database, so validation is unnecessary
         message_responses = [
-            MessageResponse(
+            MessageResponse.model_construct(
                 id=str(msg.id),
                 role=msg.role,
                 content=msg.content,
@@ -173,7 +182,7 @@ async def get_conversation_history(
             for msg in messages
         ]
         
-        return ConversationHistoryResponse(
+        return ConversationHistoryResponse.model_construct(
             conversation_id=str(conversation.id),
             messages=message_responses
         )
@@ -190,32 +199,33 @@ async def get_conversation_history(
 
 @router.get("/conversations")
 async def list_conversations(
-    authorization: str = Header(...),
+    auth: AuthContext = Depends(get_auth_context),
     db: Session = Depends(get_db)
 ):
     """List all conversations for the current user."""
     try:
-        # Extract token and verify user
-        token = authorization.replace("Bearer ", "")
-        payload = verify_token(token)
-        user_id = payload.get("sub")
-        
-        # Get conversations
-        conversations = db.query(Conversation).filter(
-            Conversation.user_id == user_id
-        ).order_by(Conversation.updated_at.desc()).all()
-        
-        return {
+        # Get conversations with their message counts in one grouped query
+        conversations = db.query(
+            Conversation.id,
+            Conversation.created_at,
+            Conversation.updated_at,
+            func.count(Message.id)
+        ).outerjoin(Message).filter(
+            Conversation.user_id == auth.user_id
+        ).group_by(Conversation.id).order_by(Conversation.updated_at.desc()).all()
+        
+        # Returned as a response directly so orjson serializes the UUIDs and datetimes
+        return ORJSONResponse({
             "conversations": [
                 {
-                    "id": str(conv.id),
-                    "created_at": conv.created_at.isoformat(),
-                    "updated_at": conv.updated_at.isoformat(),
-                    "message_count": len(conv.messages)
+                    "id": conv_id,
+                    "created_at": created_at,
+                    "updated_at": updated_at,
+                    "message_count": message_count
                 }
-                for conv in conversations
+                for conv_id, created_at, updated_at, message_count in conversations
             ]
-        }
+        })
         
     except Exception as e:
         logger.error(f"Error listing conversations: {e}", exc_info=True)
@@ -225,11 +235,41 @@ async def list_conversations(
         )
 
 
+@router.get("/search")
+async def search_conversations(
+    q: str,
+    limit: int = 20,
+    auth: AuthContext = Depends(get_auth_context),
+    db: Session = Depends(get_db)
+):
+    """Search the current user's messages across all conversations."""
+    try:
+        messages = search_messages(db, auth.user_id, q, min(limit, 100))
+        
+        return ORJSONResponse({
+            "messages": [
+                {
+                    "id": msg_id,
+                    "conversation_id": conv_id,
+                    "role": role,
+                    "content": content,
+                    "created_at": created_at
+                }
+                for msg_id, conv_id, role, content, created_at in messages
+            ],
+            "count": len(messages)
+        })
+        
+    except Exception as e:
+        logger.error(f"Error searching messages: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to search messages")
+
+
 # ============= Gmail Endpoints =============
 
 @router.get("/gmail/emails")
 async def get_emails(
-    authorization: str = Header(...),
+    auth: AuthContext = Depends(get_auth_context),
     max_results: int = 10,
     query: str = "",
     db: Session = Depends(get_db)
@@ -238,14 +278,12 @@ async def get_emails(
     from gmail_tools import gmail_tools
     
     try:
-        token = authorization.replace("Bearer ", "")
-        payload = verify_token(token)
-        user_id = payload.get("sub")
-        
         emails = await gmail_tools.fetch_emails(
-            user_id=user_id,
+            user_id=auth.user_id,
             max_results=max_results,
-            query=query
+            query=query,
+            session_id=auth.session_id,
+            db=db
         )
         
         return {"emails": emails, "count": len(emails)}
@@ -257,7 +295,7 @@ async def get_emails(
 
 @router.get("/gmail/important")
 async def get_important_emails(
-    authorization: str = Header(...),
+    auth: AuthContext = Depends(get_auth_context),
     days: int = 3,
     db: Session = Depends(get_db)
 ):
@@ -265,11 +303,12 @@ async def get_important_emails(
     from gmail_tools import gmail_tools
     
     try:
-        token = authorization.replace("Bearer ", "")
-        payload = verify_token(token)
-        user_id = payload.get("sub")
-        
-        emails = await gmail_tools.get_important_emails(user_id=user_id, days=days)
+        emails = await gmail_tools.get_important_emails(
+            user_id=auth.user_id,
+            days=days,
+            session_id=auth.session_id,
+            db=db
+        )
         
         return {"emails": emails, "count": len(emails)}
         
@@ -282,7 +321,7 @@ async def get_important_emails(
 
 @router.get("/calendar/events")
 async def get_calendar_events(
-    authorization: str = Header(...),
+    auth: AuthContext = Depends(get_auth_context),
     days: int = 7,
     db: Session = Depends(get_db)
 ):
@@ -290,11 +329,12 @@ async def get_calendar_events(
     from calendar_tools import calendar_tools
     
     try:
-        token = authorization.replace("Bearer ", "")
-        payload = verify_token(token)
-        user_id = payload.get("sub")
-        
-        events = await calendar_tools.get_upcoming_events(user_id=user_id, days=days)
+        events = await calendar_tools.get_upcoming_events(
+            user_id=auth.user_id,
+            days=days,
+            session_id=auth.session_id,
+            db=db
+        )
         
         return {"events": events, "count": len(events)}
         
@@ -305,18 +345,14 @@ async def get_calendar_events(
 
 @router.get("/calendar/today")
 async def get_today_schedule(
-    authorization: str = Header(...),
+    auth: AuthContext = Depends(get_auth_context),
     db: Session = Depends(get_db)
 ):
     """Get today's schedule."""
     from calendar_tools import calendar_tools
     
     try:
-        token = authorization.replace("Bearer ", "")
-        payload = verify_token(token)
-        user_id = payload.get("sub")
-        
-        events = await calendar_tools.get_today_schedule(user_id=user_id)
+        events = await calendar_tools.get_today_schedule(user_id=auth.user_id, session_id=auth.session_id, db=db)
         
         return {"events": events, "count": len(events)}
         
@@ -329,18 +365,14 @@ async def get_today_schedule(
 
 @router.get("/memory")
 async def get_user_memories(
-    authorization: str = Header(...),
+    auth: AuthContext = Depends(get_auth_context),
     db: Session = Depends(get_db)
 ):
     """Get all learned memories for the current user."""
     from memory_brain import memory_brain
     
     try:
-        token = authorization.replace("Bearer ", "")
-        payload = verify_token(token)
-        user_id = payload.get("sub")
-        
-        memories = await memory_brain.get_all_memories(user_id=user_id)
+        memories = await memory_brain.get_all_memories(user_id=auth.user_id, db=db)
         
         return {"memories": memories, "count": len(memories)}
         
@@ -352,18 +384,14 @@ async def get_user_memories(
 @router.delete("/memory/{memory_id}")
 async def delete_memory(
     memory_id: str,
-    authorization: str = Header(...),
+    auth: AuthContext = Depends(get_auth_context),
     db: Session = Depends(get_db)
 ):
     """Delete a specific memory entry."""
     from memory_brain import memory_brain
     
     try:
-        token = authorization.replace("Bearer ", "")
-        payload = verify_token(token)
-        user_id = payload.get("sub")
-        
-        success = await memory_brain.delete_memory(user_id=user_id, memory_id=memory_id)
+        success = await memory_brain.delete_memory(user_id=auth.user_id, memory_id=memory_id, db=db)
         
         if success:
             return {"success": True, "message": "Memory deleted"}
@@ -2,8 +2,11 @@
 Configuration management for the application.
 Loads environment variables and provides configuration settings.
 """
+from pydantic import field_validator
 from pydantic_settings import BaseSettings
-from typing import Optional
+from functools import lru_cache
+from typing import Any, Optional
+import json
 
 
 class Settings(BaseSettings):
@@ -25,6 +28,18 @@ class Settings(BaseSettings):
     GOOGLE_API_KEY: str
     GEMINI_MODEL: str = "gemini-pro"
     
+    # Chat
+    HISTORY_WINDOW: int = 20  # Most recent messages sent to the agent
+    
+    # Embeddings
+    EMBEDDING_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
+    
+    # Semantic response cache
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 1000
+    SEMANTIC_CACHE_PATH: str = "semantic_cache.npz"
+    
     # Security
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
@@ -34,15 +49,15 @@ class Settings(BaseSettings):
     FRONTEND_URL: str = "http://localhost:3000"
     
     # CORS
-    CORS_ORIGINS: str = '["http://localhost:3000"]'
+    CORS_ORIGINS: list[str] = ["http://localhost:3000"]
     
-    @property
-    def cors_origins_list(self) -> list[str]:
-        """Parse CORS_ORIGINS string to list."""
-        import json
-        if isinstance(self.CORS_ORIGINS, str):
-            return json.loads(self.CORS_ORIGINS)
-        return self.CORS_ORIGINS
+    @field_validator("CORS_ORIGINS", mode="before")
+    @classmethod
+    def parse_cors_origins(cls, value: Any) -> Any:
+        """Parse a JSON list of origins once, when settings are loaded."""
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
     
     # Rate Limiting
     RATE_LIMIT_PER_MINUTE: int = 60
@@ -55,5 +70,11 @@ class Settings(BaseSettings):
         case_sensitive = True
 
 
-# Global settings instance
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Get the application settings, loaded once from the environment."""
+    return Settings()
+
+
+# Global settings instance for module-level setup; route handlers take Depends(get_settings) so tests can override it
+settings = get_settings()
@@ -1,27 +1,38 @@
 """
 Database models and connection management.
 """
-from sqlalchemy import create_engine, Column, String, DateTime, Float, Text, ForeignKey, CheckConstraint, JSON
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy.dialects.postgresql import UUID
-from datetime import datetime
+from sqlalchemy import create_engine, text, desc, func, Column, Computed, String, DateTime, Float, Text, ForeignKey, CheckConstraint, Index
+from sqlalchemy.orm import DeclarativeBase, sessionmaker, relationship, deferred, Session as OrmSession
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR, UUID
+from pgvector.sqlalchemy import Vector
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
 import uuid
 from config import settings
+from embeddings import EMBEDDING_DIM
 
 # Database engine
 engine = create_engine(
     settings.DATABASE_URL,
     pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20
+    pool_size=20,
+    max_overflow=30,
+    pool_timeout=5,  # Fail fast instead of queueing requests behind an exhausted pool
+    pool_use_lifo=True,  # Keep a small hot set of connections; idle extras time out
+    pool_recycle=1800,
+    query_cache_size=1200,  # Compiled SQL cache entries (default 500)
+    executemany_mode="values_plus_batch"  # Send batched UPDATEs in pages, not one round trip per row
 )
 
 # Session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Base class for models
-Base = declarative_base()
+class Base(DeclarativeBase):
+    pass
+
+# Timestamps are naive UTC, stamped by the database rather than the app
+utc_now = func.timezone('utc', func.now())
 
 
 def get_db():
@@ -33,6 +44,20 @@ def get_db():
         db.close()
 
 
+@contextmanager
+def use_session(db: Optional[OrmSession] = None) -> Iterator[OrmSession]:
+    """Use the caller's session if given, otherwise open (and close) a new one."""
+    if db is not None:
+        yield db
+        return
+    
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
 # Models
 class User(Base):
     """User model for storing user information."""
@@ -42,13 +67,13 @@ class User(Base):
     email = Column(String(255), unique=True, nullable=False, index=True)
     name = Column(String(255))
     google_id = Column(String(255), unique=True, index=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utc_now)
+    updated_at = Column(DateTime, server_default=utc_now, onupdate=utc_now)
     
     # Relationships
-    sessions = relationship("Session", back_populates="user", cascade="all, delete-orphan")
-    conversations = relationship("Conversation", back_populates="user", cascade="all, delete-orphan")
-    memory_entries = relationship("MemoryEntry", back_populates="user", cascade="all, delete-orphan")
+    sessions = relationship("Session", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    conversations = relationship("Conversation", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    memory_entries = relationship("MemoryEntry", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class Session(Base):
@@ -60,7 +85,11 @@ class Session(Base):
     access_token_encrypted = Column(Text, nullable=False)
     refresh_token_encrypted = Column(Text, nullable=False)
     expires_at = Column(DateTime, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utc_now)
+    
+    __table_args__ = (
+        Index("ix_sessions_user_created", "user_id", desc("created_at")),
+    )
     
     # Relationships
     user = relationship("User", back_populates="sessions")
@@ -72,12 +101,16 @@ class Conversation(Base):
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utc_now)
+    updated_at = Column(DateTime, server_default=utc_now, onupdate=utc_now)
+    
+    __table_args__ = (
+        Index("ix_conversations_user_updated", "user_id", desc("updated_at")),
+    )
     
     # Relationships
     user = relationship("User", back_populates="conversations")
-    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
+    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class Message(Base):
@@ -88,10 +121,14 @@ class Message(Base):
     conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
     role = Column(String(20), nullable=False)
     content = Column(Text, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utc_now)
+    # Maintained by Postgres for full-text search; never loaded unless asked for
+    content_tsv = deferred(Column(TSVECTOR, Computed("to_tsvector('english', content)", persisted=True)))
     
     __table_args__ = (
         CheckConstraint("role IN ('user', 'assistant')", name="check_role"),
+        Index("ix_messages_conv_created", "conversation_id", "created_at"),
+        Index("ix_messages_content_tsv", "content_tsv", postgresql_using="gin"),
     )
     
     # Relationships
@@ -108,21 +145,66 @@ class MemoryEntry(Base):
     category = Column(String(50), nullable=False)
     source = Column(String(50), nullable=False)
     confidence = Column(Float, nullable=False)
-    extra_data = Column(JSON, default={})
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Stored in the "metadata" column, a name the declarative base reserves for itself
+    extra_data = Column("metadata", JSONB, nullable=False, server_default=text("'{}'::jsonb"))
+    embedding = Column(Vector(EMBEDDING_DIM), nullable=True)
+    created_at = Column(DateTime, server_default=utc_now)
+    updated_at = Column(DateTime, server_default=utc_now, onupdate=utc_now)
+    # Maintained by Postgres for keyword relevance; never loaded unless asked for
+    content_tsv = deferred(Column(TSVECTOR, Computed("to_tsvector('english', content)", persisted=True)))
     
     __table_args__ = (
         CheckConstraint("confidence >= 0 AND confidence <= 1", name="check_confidence"),
+        # One row per content; hashed because a long message can exceed the B-tree row limit
+        Index("ix_memory_entries_user_content_md5", "user_id", func.md5(content), unique=True),
+        # Category retrieval and full listings, both read in confidence/recency order
+        Index(
+            "ix_memory_entries_user_cat_conf_upd",
+            "user_id", "category", desc("confidence"), desc("updated_at")
+        ),
+        Index("ix_memory_entries_user_updated", "user_id", desc("updated_at")),
+        Index("ix_memory_entries_created_at_brin", "created_at", postgresql_using="brin"),
+        Index("ix_memory_entries_metadata", "metadata", postgresql_using="gin"),
+        Index("ix_memory_entries_content_tsv", "content_tsv", postgresql_using="gin"),
+        Index(
+            "ix_memory_entries_embedding", "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"embedding": "vector_cosine_ops"}
+        ),
     )
     
     # Relationships
     user = relationship("User", back_populates="memory_entries")
 
 
+def search_messages(db: OrmSession, user_id: str, query: str, limit: int = 20) -> List:
+    """
+    Full-text search over a user's messages, best matches first.
+    
+    Args:
+        db: Database session
+        user_id: The user's ID
+        query: Plain search text
+        limit: Maximum number of messages
+    
+    Returns:
+        (id, conversation_id, role, content, created_at) rows
+    """
+    tsquery = func.plainto_tsquery('english', query)
+    return db.query(
+        Message.id, Message.conversation_id, Message.role, Message.content, Message.created_at
+    ).join(Conversation).filter(
+        Conversation.user_id == user_id,
+        Message.content_tsv.op('@@')(tsquery)
+    ).order_by(func.ts_rank(Message.content_tsv, tsquery).desc()).limit(limit).all()
+
+
 # Create all tables
 def init_db():
     """Initialize database tables."""
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
     Base.metadata.create_all(bind=engine)
 
 
@@ -0,0 +1,75 @@
+"""
+Local sentence embeddings for the AI assistant.
+Wraps a small SentenceTransformer model that is loaded on first use.
+"""
+from typing import List, Optional
+import threading
+import logging
+
+import numpy as np
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Output size of all-MiniLM-L6-v2
+EMBEDDING_DIM = 384
+
+
+class Embedder:
+    """Lazily-loaded sentence embedding model producing L2-normalized vectors."""
+
+    def __init__(self, model_name: str = settings.EMBEDDING_MODEL):
+        """Initialize the embedder without loading the model."""
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        """Load the SentenceTransformer model on first use."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    # Imported here so that modules using embeddings stay cheap to import
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name)
+                    logger.info(f"Loaded embedding model {self.model_name}")
+        return self._model
+
+    def encode(self, text: str) -> Optional[np.ndarray]:
+        """
+        Embed a piece of text.
+
+        Args:
+            text: The text to embed
+
+        Returns:
+            Normalized float32 vector, or None if the model is unavailable
+        """
+        try:
+            vector = self._get_model().encode(text, normalize_embeddings=True)
+            return np.asarray(vector, dtype=np.float32)
+        except Exception as e:
+            logger.error(f"Error encoding text: {e}")
+            return None
+
+    def encode_batch(self, texts: List[str]) -> Optional[np.ndarray]:
+        """
+        Embed several pieces of text in one model call.
+
+        Args:
+            texts: The texts to embed
+
+        Returns:
+            (len(texts), EMBEDDING_DIM) array of normalized float32 vectors, or None if the model is unavailable
+        """
+        try:
+            vectors = self._get_model().encode(texts, normalize_embeddings=True)
+            return np.asarray(vectors, dtype=np.float32).reshape(len(texts), EMBEDDING_DIM)
+        except Exception as e:
+            logger.error(f"Error encoding texts: {e}")
+            return None
+
+
+# Global instance
+embedder = Embedder()
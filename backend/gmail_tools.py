@@ -2,72 +2,389 @@
 Gmail integration tools for the AI assistant.
 Provides functionality to fetch, search, and send emails using Google Gmail API.
 """
-from typing import List, Dict, Any, Optional
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+from urllib.parse import urlencode
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from collections import deque
+from contextlib import aclosing
+from dataclasses import dataclass
+from weakref import WeakValueDictionary
+import asyncio
+import random
 import base64
 import logging
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import uuid
+from email.message import EmailMessage
+from email.policy import SMTP
 
-from database import SessionLocal, User, Session as DBSession
-from auth import decrypt_token
+import httpx
+import orjson
+
+from auth import GoogleAccessTokens
 
 logger = logging.getLogger(__name__)
 
+MESSAGES_URL = "https://gmail.googleapis.com/gmail/v1/users/me/messages"
+BATCH_URL = "https://gmail.googleapis.com/batch/gmail/v1"
+
+# Gmail allows 250 quota units per user per second; calls past it come back as 429s
+MAX_IN_FLIGHT = 5
+RETRYABLE_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+SUMMARY_HEADERS = frozenset(('From', 'Subject', 'Date'))
+DETAIL_HEADERS = frozenset(('From', 'To', 'Subject', 'Date'))
+REPLY_HEADERS = frozenset(('Subject',))
+
+SUMMARY_QUERY = urlencode([('format', 'metadata')] + [('metadataHeaders', h) for h in sorted(SUMMARY_HEADERS)])
+
+
+def _extract_headers(payload: Dict[str, Any], wanted: frozenset) -> Dict[str, str]:
+    """
+    Pick the wanted headers out of a message payload in one pass.
+    
+    Args:
+        payload: The message payload from the Gmail API
+        wanted: Header names to keep
+    
+    Returns:
+        Values of the wanted headers that are present, by name
+    """
+    found = {}
+    for header in payload.get('headers', ()):
+        name = header['name']
+        if name in wanted:
+            found[name] = header['value']
+            if len(found) == len(wanted):
+                break
+    return found
+
+
+def _extract_body(payload: Dict[str, Any]) -> str:
+    """
+    Get the text of a message payload.
+    
+    A single-part message's own body is used as is; otherwise the MIME tree
+    is searched breadth-first for the first text/plain part, so plain text
+    nested in multipart/alternative or multipart/mixed is found too.
+    
+    Args:
+        payload: The message payload from the Gmail API
+    
+    Returns:
+        The decoded body text, or "" if there is none
+    """
+    data = payload.get('body', {}).get('data')
+    if not data:
+        parts = deque(payload.get('parts', ()))
+        while parts:
+            part = parts.popleft()
+            if part.get('mimeType') == 'text/plain':
+                data = part.get('body', {}).get('data')
+                if data:
+                    break
+            parts.extend(part.get('parts', ()))
+    
+    if not data:
+        return ""
+    return base64.urlsafe_b64decode(data).decode('utf-8', errors='replace')
+
+
+def _summarize(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the summary returned for a listed email."""
+    headers = _extract_headers(message.get('payload', {}), SUMMARY_HEADERS)
+    
+    return {
+        'id': message['id'],
+        'from': headers.get('From', 'Unknown'),
+        'subject': headers.get('Subject', '(No subject)'),
+        'date': headers.get('Date', ''),
+        'snippet': message.get('snippet', '')[:100]
+    }
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How often, and how long, to retry throttled Gmail requests."""
+    retries: int
+    max_backoff_seconds: float
+
+
+# Background syncs can wait out a throttle; a chat turn should fail fast instead
+BACKGROUND_RETRY = RetryPolicy(retries=5, max_backoff_seconds=30)
+INTERACTIVE_RETRY = RetryPolicy(retries=2, max_backoff_seconds=4)
+NO_RETRY = RetryPolicy(retries=0, max_backoff_seconds=0)
+
+
+def _backoff_seconds(attempt: int, retry_after: Optional[str], policy: RetryPolicy) -> Optional[float]:
+    """
+    Delay before retrying a throttled request.
+    
+    Args:
+        attempt: Zero-based number of the attempt that failed
+        retry_after: The response's Retry-After header, if any
+        policy: Retry budget of the call
+    
+    Returns:
+        Exponential backoff with jitter, or longer if Gmail asked for it;
+        None once the budget is spent or Gmail asks for a longer wait than it allows
+    """
+    if attempt >= policy.retries:
+        return None
+    
+    delay = min(2 ** attempt + random.random(), policy.max_backoff_seconds)
+    try:
+        delay = max(delay, float(retry_after or 0))
+    except ValueError:
+        # HTTP-date form; fall back to our own backoff
+        pass
+    return delay if delay <= policy.max_backoff_seconds else None
+
+
+def _build_batch_body(boundary: str, requests: List[Tuple[int, str]]) -> str:
+    """
+    Encode GET requests as a multipart/mixed batch body.
+    
+    Args:
+        boundary: The multipart boundary
+        requests: (index, path with query string) pairs; the index becomes the Content-ID
+    
+    Returns:
+        The request body
+    """
+    parts = [
+        f"--{boundary}\r\n"
+        "Content-Type: application/http\r\n"
+        f"Content-ID: <{index}>\r\n\r\n"
+        f"GET {path}\r\n\r\n"
+        for index, path in requests
+    ]
+    return "".join(parts) + f"--{boundary}--\r\n"
+
+
+def _parse_batch_response(content_type: str, text: str) -> Dict[int, Tuple[int, Dict[str, str], str]]:
+    """
+    Split a multipart/mixed batch response into its embedded HTTP responses.
+    
+    Args:
+        content_type: The batch response's Content-Type, which carries the boundary
+        text: The batch response body
+    
+    Returns:
+        Status, lower-cased headers and body of each response, by request index
+    """
+    boundary = content_type.split('boundary=', 1)[1].split(';', 1)[0].strip('"')
+    responses = {}
+    
+    for part in text.replace('\r\n', '\n').split(f"--{boundary}"):
+        part = part.strip()
+        if not part or part == '--':
+            continue
+        
+        part_headers, _, http_response = part.partition('\n\n')
+        content_id = next(
+            line.split(':', 1)[1].strip()
+            for line in part_headers.split('\n')
+            if line.lower().startswith('content-id:')
+        )
+        # Google answers Content-ID <n> with <response-n>
+        index = int(content_id.strip('<>').rpartition('-')[2])
+        
+        status_line, _, rest = http_response.partition('\n')
+        header_block, _, body = rest.partition('\n\n')
+        headers = {}
+        for line in header_block.split('\n'):
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        
+        responses[index] = (int(status_line.split()[1]), headers, body.strip())
+    
+    return responses
+
 
 class GmailTools:
     """Gmail API tools for the agent."""
     
     def __init__(self):
         """Initialize Gmail tools."""
-        self.scopes = [
-            'https://www.googleapis.com/auth/gmail.readonly',
-            'https://www.googleapis.com/auth/gmail.compose'
-        ]
+        self._tokens = GoogleAccessTokens()
+        self._client: Optional[httpx.AsyncClient] = None
+        # Caps each user's concurrent Gmail requests, since quota is per user; dropped when unused
+        self._in_flight: WeakValueDictionary = WeakValueDictionary()
     
-    def _get_gmail_service(self, user_id: str, db: Session):
-        """Get authenticated Gmail service for a user."""
-        try:
-            # Get user session with stored tokens
-            user = db.query(User).filter(User.id == user_id).first()
-            if not user:
-                raise ValueError(f"User {user_id} not found")
+    def _get_client(self) -> httpx.AsyncClient:
+        """Get the shared HTTP client, creating it on first use."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=10,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+            )
+        return self._client
+    
+    async def aclose(self) -> None:
+        """Close the shared HTTP client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def _get_access_token(
+        self,
+        user_id: str,
+        session_id: Optional[str],
+        db: Optional[Session],
+        stale: Optional[str] = None
+    ) -> str:
+        """Get the user's Google access token, refreshing it once if it is the stale one that got a 401."""
+        return await self._tokens.get(self._get_client(), user_id, session_id, db, stale)
+    
+    async def _send(
+        self,
+        user_id: str,
+        method: str,
+        url: str,
+        access_token: str,
+        retry: RetryPolicy,
+        headers: Optional[Dict[str, str]] = None,
+        **kwargs
+    ) -> httpx.Response:
+        """Send a request, retrying 429s and 5xxs with backoff."""
+        headers = {**(headers or {}), "Authorization": f"Bearer {access_token}"}
+        attempt = 0
+        while True:
+            # Bursts queue here instead of spending the user's quota on 429s
+            async with self._in_flight.setdefault(user_id, asyncio.Semaphore(MAX_IN_FLIGHT)):
+                response = await self._get_client().request(method, url, headers=headers, **kwargs)
+            if response.status_code not in RETRYABLE_STATUSES:
+                return response
             
-            session = db.query(DBSession).filter(
-                DBSession.user_id == user_id
-            ).order_by(DBSession.created_at.desc()).first()
+            delay = _backoff_seconds(attempt, response.headers.get('retry-after'), retry)
+            if delay is None:
+                return response
+            await asyncio.sleep(delay)
+            attempt += 1
+    
+    async def _request(
+        self,
+        user_id: str,
+        session_id: Optional[str],
+        db: Optional[Session],
+        method: str,
+        url: str,
+        retry: RetryPolicy = BACKGROUND_RETRY,
+        **kwargs
+    ) -> httpx.Response:
+        """Send an authorized Gmail request, refreshing the access token once on a 401."""
+        access_token = await self._get_access_token(user_id, session_id, db)
+        response = await self._send(user_id, method, url, access_token, retry, **kwargs)
+        if response.status_code == 401:
+            access_token = await self._get_access_token(user_id, session_id, db, stale=access_token)
+            response = await self._send(user_id, method, url, access_token, retry, **kwargs)
+        
+        response.raise_for_status()
+        return response
+    
+    async def _fetch_summaries(
+        self,
+        user_id: str,
+        session_id: Optional[str],
+        db: Optional[Session],
+        messages: List[Dict[str, Any]],
+        retry: RetryPolicy
+    ) -> List[Dict[str, Any]]:
+        """Fetch summaries for listed message ids in one batch request, in list order."""
+        summaries: List[Optional[Dict[str, Any]]] = [None] * len(messages)
+        
+        pending = range(len(messages))
+        attempt = 0
+        while True:
+            # Fetch all pending message details in one multipart request
+            boundary = f"batch_{uuid.uuid4().hex}"
+            response = await self._request(
+                user_id, session_id, db, 'POST', BATCH_URL, retry,
+                content=_build_batch_body(boundary, [
+                    (i, f"/gmail/v1/users/me/messages/{messages[i]['id']}?{SUMMARY_QUERY}")
+                    for i in pending
+                ]),
+                headers={"Content-Type": f"multipart/mixed; boundary={boundary}"}
+            )
             
-            if not session:
-                raise ValueError(f"No active session for user {user_id}")
+            throttled: List[int] = []
+            retry_after: Optional[str] = None
+            parts = _parse_batch_response(response.headers['content-type'], response.text)
+            for index, (status, headers, body) in parts.items():
+                if status == 200:
+                    summaries[index] = _summarize(orjson.loads(body))
+                elif status in RETRYABLE_STATUSES:
+                    # Sub-requests fail on their own, so requeue just the throttled ones
+                    throttled.append(index)
+                    retry_after = headers.get('retry-after') or retry_after
+                else:
+                    logger.warning(f"Error fetching email {messages[index]['id']}: HTTP {status}")
             
-            # Decrypt access token
-            access_token = decrypt_token(session.access_token_encrypted)
-            refresh_token = decrypt_token(session.refresh_token_encrypted)
+            if not throttled:
+                break
             
-            # Create credentials
-            credentials = Credentials(
-                token=access_token,
-                refresh_token=refresh_token,
-                token_uri='https://oauth2.googleapis.com/token',
-                scopes=self.scopes
-            )
+            delay = _backoff_seconds(attempt, retry_after, retry)
+            if delay is None:
+                logger.warning(f"Gave up on {len(throttled)} throttled email fetches")
+                break
             
-            # Build Gmail service
-            service = build('gmail', 'v1', credentials=credentials)
-            return service
+            await asyncio.sleep(delay)
+            pending = throttled
+            attempt += 1
+        
+        return [summary for summary in summaries if summary is not None]
+    
+    async def iter_emails(
+        self,
+        user_id: str,
+        query: str = "",
+        page_size: int = 25,
+        session_id: Optional[str] = None,
+        db: Optional[Session] = None,
+        retry: RetryPolicy = BACKGROUND_RETRY
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Stream email summaries page by page.
+        
+        Args:
+            user_id: The user's ID
+            query: Optional Gmail search query
+            page_size: Messages per page (a batch request holds at most 100)
+            session_id: Optional session ID from the caller's JWT
+            db: Optional request-scoped session, used only to load credentials
+            retry: Retry budget for throttled requests
+        
+        Yields:
+            The email summaries of each page
+        """
+        # Build query
+        search_query = query if query else "in:inbox"
+        
+        page_token = None
+        while True:
+            # Listing costs the same quota whatever the page size
+            params = {'q': search_query, 'maxResults': page_size}
+            if page_token:
+                params['pageToken'] = page_token
+            response = await self._request(user_id, session_id, db, 'GET', MESSAGES_URL, retry, params=params)
+            results = response.json()
             
-        except Exception as e:
-            logger.error(f"Error getting Gmail service: {e}")
-            raise
+            messages = results.get('messages', [])
+            if messages:
+                yield await self._fetch_summaries(user_id, session_id, db, messages, retry)
+            
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
     
     async def fetch_emails(
         self, 
         user_id: str, 
         max_results: int = 10,
-        query: str = ""
+        query: str = "",
+        session_id: Optional[str] = None,
+        db: Optional[Session] = None,
+        retry: RetryPolicy = BACKGROUND_RETRY
     ) -> List[Dict[str, Any]]:
         """
         Fetch recent emails from user's inbox.
@@ -76,45 +393,22 @@ class GmailTools:
             user_id: The user's ID
             max_results: Maximum number of emails to fetch
             query: Optional Gmail search query
+            session_id: Optional session ID from the caller's JWT
+            db: Optional request-scoped session, used only to load credentials
+            retry: Retry budget for throttled requests
         
         Returns:
             List of email summaries
         """
-        db = SessionLocal()
         try:
-            service = self._get_gmail_service(user_id, db)
-            
-            # Build query
-            search_query = query if query else "in:inbox"
-            
-            # List messages
-            results = service.users().messages().list(
-                userId='me',
-                q=search_query,
-                maxResults=max_results
-            ).execute()
-            
-            messages = results.get('messages', [])
             email_summaries = []
-            
-            for msg in messages:
-                # Get message details
-                message = service.users().messages().get(
-                    userId='me',
-                    id=msg['id'],
-                    format='metadata',
-                    metadataHeaders=['From', 'Subject', 'Date']
-                ).execute()
-                
-                headers = {h['name']: h['value'] for h in message.get('payload', {}).get('headers', [])}
-                
-                email_summaries.append({
-                    'id': msg['id'],
-                    'from': headers.get('From', 'Unknown'),
-                    'subject': headers.get('Subject', '(No subject)'),
-                    'date': headers.get('Date', ''),
-                    'snippet': message.get('snippet', '')[:100]
-                })
+            pages = self.iter_emails(user_id, query, min(max_results, 100), session_id, db, retry)
+            async with aclosing(pages):
+                async for page in pages:
+                    email_summaries.extend(page)
+                    if len(email_summaries) >= max_results:
+                        break
+            email_summaries = email_summaries[:max_results]
             
             logger.info(f"Fetched {len(email_summaries)} emails for user {user_id}")
             return email_summaries
@@ -122,43 +416,38 @@ class GmailTools:
         except Exception as e:
             logger.error(f"Error fetching emails: {e}")
             return [{"error": str(e)}]
-        finally:
-            db.close()
     
-    async def get_email_details(self, user_id: str, email_id: str) -> Dict[str, Any]:
+    async def get_email_details(
+        self,
+        user_id: str,
+        email_id: str,
+        session_id: Optional[str] = None,
+        db: Optional[Session] = None,
+        retry: RetryPolicy = BACKGROUND_RETRY
+    ) -> Dict[str, Any]:
         """
         Get full details of a specific email.
         
         Args:
             user_id: The user's ID
             email_id: The email message ID
+            session_id: Optional session ID from the caller's JWT
+            db: Optional request-scoped session, used only to load credentials
+            retry: Retry budget for throttled requests
         
         Returns:
             Full email content
         """
-        db = SessionLocal()
         try:
-            service = self._get_gmail_service(user_id, db)
-            
-            message = service.users().messages().get(
-                userId='me',
-                id=email_id,
-                format='full'
-            ).execute()
-            
-            headers = {h['name']: h['value'] for h in message.get('payload', {}).get('headers', [])}
+            response = await self._request(
+                user_id, session_id, db, 'GET', f"{MESSAGES_URL}/{email_id}", retry,
+                params={'format': 'full'}
+            )
+            message = response.json()
             
-            # Extract body
-            body = ""
             payload = message.get('payload', {})
-            
-            if 'body' in payload and payload['body'].get('data'):
-                body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
-            elif 'parts' in payload:
-                for part in payload['parts']:
-                    if part.get('mimeType') == 'text/plain' and part.get('body', {}).get('data'):
-                        body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-                        break
+            headers = _extract_headers(payload, DETAIL_HEADERS)
+            body = _extract_body(payload)
             
             return {
                 'id': email_id,
@@ -173,14 +462,15 @@ class GmailTools:
         except Exception as e:
             logger.error(f"Error getting email details: {e}")
             return {"error": str(e)}
-        finally:
-            db.close()
     
     async def search_emails(
         self, 
         user_id: str, 
         query: str,
-        max_results: int = 10
+        max_results: int = 10,
+        session_id: Optional[str] = None,
+        db: Optional[Session] = None,
+        retry: RetryPolicy = BACKGROUND_RETRY
     ) -> List[Dict[str, Any]]:
         """
         Search emails using Gmail query syntax.
@@ -189,11 +479,14 @@ class GmailTools:
             user_id: The user's ID
             query: Gmail search query (e.g., "from:john subject:meeting")
             max_results: Maximum results to return
+            session_id: Optional session ID from the caller's JWT
+            db: Optional request-scoped session, used only to load credentials
+            retry: Retry budget for throttled requests
         
         Returns:
             List of matching emails
         """
-        return await self.fetch_emails(user_id, max_results, query)
+        return await self.fetch_emails(user_id, max_results, query, session_id, db, retry)
     
     async def send_email(
         self, 
@@ -201,7 +494,10 @@ class GmailTools:
         to: str,
         subject: str,
         body: str,
-        reply_to_id: Optional[str] = None
+        reply_to_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+        db: Optional[Session] = None,
+        retry: RetryPolicy = BACKGROUND_RETRY
     ) -> Dict[str, Any]:
         """
         Send an email or reply to an existing email.
@@ -212,46 +508,49 @@ class GmailTools:
             subject: Email subject
             body: Email body content
             reply_to_id: Optional message ID to reply to
+            session_id: Optional session ID from the caller's JWT
+            db: Optional request-scoped session, used only to load credentials
+            retry: Retry budget for looking up the replied-to email
         
         Returns:
             Send result with message ID
         """
-        db = SessionLocal()
         try:
-            service = self._get_gmail_service(user_id, db)
-            
-            # Create message
-            message = MIMEMultipart()
-            message['to'] = to
-            message['subject'] = subject
-            message.attach(MIMEText(body, 'plain'))
-            
             # If replying, get thread ID
             thread_id = None
             if reply_to_id:
-                original = service.users().messages().get(
-                    userId='me',
-                    id=reply_to_id
-                ).execute()
+                # Only the thread id and subject are needed, so skip the body
+                response = await self._request(
+                    user_id, session_id, db, 'GET', f"{MESSAGES_URL}/{reply_to_id}", retry,
+                    params={'format': 'metadata', 'metadataHeaders': list(REPLY_HEADERS)}
+                )
+                original = response.json()
                 thread_id = original.get('threadId')
                 
                 # Get original subject for reply
-                headers = {h['name']: h['value'] for h in original.get('payload', {}).get('headers', [])}
+                headers = _extract_headers(original.get('payload', {}), REPLY_HEADERS)
                 if not subject.lower().startswith('re:'):
-                    message['subject'] = f"Re: {headers.get('Subject', '')}"
+                    subject = f"Re: {headers.get('Subject', '')}"
+            
+            # A single text/plain part; no multipart envelope is needed for plain text
+            message = EmailMessage(policy=SMTP)
+            message['To'] = to
+            message['Subject'] = subject
+            message.set_content(body)
             
             # Encode message
-            raw = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+            raw = base64.urlsafe_b64encode(message.as_bytes()).decode('ascii')
             
             body_data = {'raw': raw}
             if thread_id:
                 body_data['threadId'] = thread_id
             
-            # Send
-            result = service.users().messages().send(
-                userId='me',
-                body=body_data
-            ).execute()
+            # Send; not retried, since a 5xx may come back after the message went out
+            response = await self._request(
+                user_id, session_id, db, 'POST', f"{MESSAGES_URL}/send", NO_RETRY,
+                json=body_data
+            )
+            result = response.json()
             
             logger.info(f"Email sent successfully: {result.get('id')}")
             return {
@@ -263,23 +562,31 @@ class GmailTools:
         except Exception as e:
             logger.error(f"Error sending email: {e}")
             return {'success': False, 'error': str(e)}
-        finally:
-            db.close()
     
-    async def get_important_emails(self, user_id: str, days: int = 3) -> List[Dict[str, Any]]:
+    async def get_important_emails(
+        self,
+        user_id: str,
+        days: int = 3,
+        session_id: Optional[str] = None,
+        db: Optional[Session] = None,
+        retry: RetryPolicy = BACKGROUND_RETRY
+    ) -> List[Dict[str, Any]]:
         """
         Get important/unread emails from the last N days.
         
         Args:
             user_id: The user's ID
             days: Number of days to look back
+            session_id: Optional session ID from the caller's JWT
+            db: Optional request-scoped session, used only to load credentials
+            retry: Retry budget for throttled requests
         
         Returns:
             List of important emails
         """
-        after_date = (datetime.now() - timedelta(days=days)).strftime('%Y/%m/%d')
-        query = f"is:unread OR is:important after:{after_date}"
-        return await self.fetch_emails(user_id, max_results=15, query=query)
+        # Gmail binds OR tighter than the implicit AND, so the parentheses are only there for clarity
+        query = f"(is:unread OR is:important) newer_than:{days}d -category:promotions -category:social"
+        return await self.fetch_emails(user_id, max_results=15, query=query, session_id=session_id, db=db, retry=retry)
 
 
 # Global instance
@@ -1,15 +1,19 @@
 """
 Main FastAPI application entry point.
 """
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.exc import DisconnectionError, OperationalError, SQLAlchemyError, TimeoutError as PoolTimeoutError
 from contextlib import asynccontextmanager
 import logging
 from datetime import datetime
 
-from config import settings
+from config import Settings, get_settings, settings
 from database import init_db
+from semantic_cache import semantic_cache
+from calendar_tools import calendar_tools
+from gmail_tools import gmail_tools
 import auth
 import chat
 
@@ -28,9 +32,13 @@ async def lifespan(app: FastAPI):
     logger.info("Starting application...")
     init_db()
     logger.info("Database initialized")
+    semantic_cache.load()
     yield
     # Shutdown
     logger.info("Shutting down application...")
+    semantic_cache.save()
+    await calendar_tools.aclose()
+    await gmail_tools.aclose()
 
 
 # Create FastAPI app
@@ -38,13 +46,14 @@ app = FastAPI(
     title=settings.APP_NAME,
     description="A contextual agentic AI assistant with dynamic memory",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=settings.cors_origins_list,
+    allow_origins=settings.CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -53,12 +62,12 @@ app.add_middleware(
 
 # Health check endpoint
 @app.get("/api/health")
-async def health_check():
+async def health_check(app_settings: Settings = Depends(get_settings)):
     """Health check endpoint for monitoring."""
     return {
         "status": "healthy",
         "timestamp": datetime.utcnow().isoformat(),
-        "service": settings.APP_NAME
+        "service": app_settings.APP_NAME
     }
 
 
@@ -78,20 +87,23 @@ app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(chat.router, prefix="/api/chat", tags=["Chat"])
 
 
-# Global exception handler
-@app.exception_handler(Exception)
-async def global_exception_handler(request: Request, exc: Exception):
-    """Global exception handler for unhandled errors."""
-    logger.error(f"Unhandled exception: {exc}", exc_info=True)
-    return JSONResponse(
-        status_code=500,
+# Database outages that escape a route; other errors (integrity, bad SQL) are bugs and stay 500s
+async def database_exception_handler(request: Request, exc: SQLAlchemyError):
+    """Return a 503 for database outages not handled by the route."""
+    logger.exception(f"Database error on {request.url.path}: {exc}")
+    return ORJSONResponse(
+        status_code=503,
         content={
-            "error": "Internal server error",
+            "error": "Database unavailable",
             "message": "An unexpected error occurred. Please try again later."
         }
     )
 
 
+for unavailable_error in (OperationalError, DisconnectionError, PoolTimeoutError):
+    app.add_exception_handler(unavailable_error, database_exception_handler)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
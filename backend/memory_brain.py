@@ -2,15 +2,30 @@
 Memory Brain system for the AI assistant.
 Implements dynamic long-term memory that learns from conversations and emails.
 """
-from typing import List, Dict, Any, Optional
-from sqlalchemy.orm import Session
-from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+from sqlalchemy import Integer, String, Text, case, cast, column, func, literal_column, or_, select, true, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session, aliased
+from pgvector.sqlalchemy import Vector
+from cachetools import TTLCache
+from bisect import bisect_right
+from itertools import accumulate
+import asyncio
 import logging
 import json
 import re
 
-from database import SessionLocal, MemoryEntry, User
+import numpy as np
+
+# RE2 matches in linear time, so long messages cannot trigger catastrophic backtracking
+try:
+    import re2 as regex_engine
+except ImportError:
+    regex_engine = re
+
+from database import use_session, utc_now, MemoryEntry, User
 from config import settings
+from embeddings import EMBEDDING_DIM, embedder
 
 logger = logging.getLogger(__name__)
 
@@ -34,15 +49,48 @@ class MemorySource:
     EXPLICIT = "explicit"          # User explicitly stated
 
 
+# Email keywords, in priority order for the status fact
+STATUS_KEYWORDS = ('delayed', 'completed', 'cancelled', 'on hold', 'urgent', 'deadline')
+
+
+def _compile(pattern: str):
+    """Compile a case-insensitive pattern with the regex engine in use."""
+    # An inline flag is understood by both re and RE2, unlike re.IGNORECASE
+    return regex_engine.compile(f"(?i){pattern}")
+
+
+EMAIL_KEYWORD_PATTERN = _compile(
+    "|".join(re.escape(keyword) for keyword in STATUS_KEYWORDS + ('important', 'asap'))
+)
+
+# Insert that folds an exact duplicate into the existing memory, keeping the higher confidence
+_insert_memory = insert(MemoryEntry)
+_UPSERT_MEMORIES = _insert_memory.on_conflict_do_update(
+    index_elements=[MemoryEntry.user_id, func.md5(MemoryEntry.content)],
+    set_={'confidence': _insert_memory.excluded.confidence, 'updated_at': utc_now},
+    where=_insert_memory.excluded.confidence > MemoryEntry.confidence
+)
+
+# Cosine distance under which a new fact counts as a restatement of an existing memory
+SEMANTIC_DUPLICATE_DISTANCE = 0.15
+
+
 class MemoryBrain:
     """
     Dynamic memory system that learns from user interactions.
     Stores and retrieves contextual information for personalized responses.
+    Database and embedding work is synchronous, so the async methods run it on worker threads.
     """
     
     def __init__(self):
         """Initialize the Memory Brain."""
-        self.preference_patterns = [
+        # Read results per user, keyed by call; dropped whenever that user's memories change
+        self._read_cache = TTLCache(maxsize=10_000, ttl=60)
+        
+        # Highest confidence stored for each recent fact content, per user
+        self._known_facts = TTLCache(maxsize=10_000, ttl=3600)
+        
+        preference_patterns = [
             (r"i (?:hate|don't like|dislike|avoid) (.+)", MemoryCategory.PREFERENCE),
             (r"i (?:love|like|prefer|enjoy) (.+)", MemoryCategory.PREFERENCE),
             (r"i never (.+)", MemoryCategory.PREFERENCE),
@@ -52,16 +100,44 @@ class MemoryBrain:
             (r"(?:call me|address me as) (\w+)", MemoryCategory.PREFERENCE),
         ]
         
-        self.project_patterns = [
+        project_patterns = [
             (r"(?:project|task) (\w+) (?:is|was|has been) (delayed|cancelled|completed|on track)", MemoryCategory.PROJECT),
             (r"(\w+) project (?:is|was) (.*)", MemoryCategory.PROJECT),
             (r"deadline for (.+) (?:is|was|has been) (?:extended|moved|changed)", MemoryCategory.PROJECT),
         ]
+        
+        # Compiled once and case-insensitive, so message content is matched without lowercasing
+        self.preference_patterns = [(_compile(pattern), category) for pattern, category in preference_patterns]
+        self.project_patterns = [(_compile(pattern), category) for pattern, category in project_patterns]
+        
+        # Every pattern with the confidence and match group of the fact it yields, so one loop handles both kinds
+        self.fact_patterns = tuple(
+            [(pattern, category, 0.9, 1) for pattern, category in self.preference_patterns]
+            + [(pattern, category, 0.85, 0) for pattern, category in self.project_patterns]
+        )
+        
+        # All patterns as one alternation, so messages that match none are rejected in one scan
+        self.any_pattern = _compile(
+            "|".join(f"(?:{pattern})" for pattern, _ in preference_patterns + project_patterns)
+        )
+    
+    def _cached_reads(self, user_id: str) -> Dict[Any, Any]:
+        """Get the read cache for a user, creating it on first use."""
+        reads = self._read_cache.get(user_id)
+        if reads is None:
+            reads = self._read_cache[user_id] = {}
+        return reads
+    
+    def _invalidate(self, user_id: str) -> None:
+        """Forget cached reads for a user after a write."""
+        # A read still in flight fills the dict popped here, which is never consulted again
+        self._read_cache.pop(user_id, None)
     
     async def extract_facts_from_conversation(
         self, 
         messages: List[Dict[str, str]],
-        user_id: str
+        user_id: str,
+        db: Optional[Session] = None
     ) -> List[Dict[str, Any]]:
         """
         Extract facts and preferences from a conversation.
@@ -69,54 +145,47 @@ class MemoryBrain:
         Args:
             messages: List of conversation messages
             user_id: The user's ID
+            db: Optional request-scoped session; a new one is opened if omitted
         
         Returns:
             List of extracted facts
         """
         extracted_facts = []
         
-        for msg in messages:
-            if msg.get('role') != 'user':
-                continue
-                
-            content = msg.get('content', '').lower()
-            
-            # Check preference patterns
-            for pattern, category in self.preference_patterns:
-                match = re.search(pattern, content, re.IGNORECASE)
-                if match:
-                    fact = {
-                        'content': msg.get('content', ''),
-                        'category': category,
-                        'source': MemorySource.CHAT,
-                        'confidence': 0.9,
-                        'extracted_value': match.group(1) if match.groups() else content
-                    }
-                    extracted_facts.append(fact)
+        # User messages joined by newlines, which no pattern can match across
+        contents = [msg.get('content', '') for msg in messages if msg.get('role') == 'user']
+        buffer = "\n".join(contents)
+        starts = [0, *accumulate(len(content) + 1 for content in contents[:-1])]
+        
+        # One scan over the whole conversation finds the messages worth checking pattern by pattern
+        matched = sorted({bisect_right(starts, match.start()) - 1 for match in self.any_pattern.finditer(buffer)})
+        
+        for index in matched:
+            content = contents[index]
             
-            # Check project patterns
-            for pattern, category in self.project_patterns:
-                match = re.search(pattern, content, re.IGNORECASE)
+            # Check preference and project patterns
+            for pattern, category, confidence, value_group in self.fact_patterns:
+                match = pattern.search(content)
                 if match:
-                    fact = {
-                        'content': msg.get('content', ''),
+                    extracted_facts.append({
+                        'content': content,
                         'category': category,
                         'source': MemorySource.CHAT,
-                        'confidence': 0.85,
-                        'extracted_value': match.group(0)
-                    }
-                    extracted_facts.append(fact)
+                        'confidence': confidence,
+                        'extracted_value': match.group(value_group)
+                    })
         
         # Store extracted facts
         if extracted_facts:
-            await self.store_facts(user_id, extracted_facts)
+            await self.store_facts(user_id, extracted_facts, db)
         
         return extracted_facts
     
     async def extract_facts_from_email(
         self, 
         email: Dict[str, Any],
-        user_id: str
+        user_id: str,
+        db: Optional[Session] = None
     ) -> List[Dict[str, Any]]:
         """
         Extract facts from an email (project updates, contacts, etc.).
@@ -124,20 +193,24 @@ class MemoryBrain:
         Args:
             email: Email content dictionary
             user_id: The user's ID
+            db: Optional request-scoped session; a new one is opened if omitted
         
         Returns:
             List of extracted facts
         """
         extracted_facts = []
         
-        subject = email.get('subject', '').lower()
-        body = email.get('body', '').lower()
+        subject = email.get('subject', '')
+        body = email.get('body', '')
         sender = email.get('from', '')
         
+        # One scan each of subject and body finds every keyword present
+        subject_hits = {hit.lower() for hit in EMAIL_KEYWORD_PATTERN.findall(subject)}
+        body_hits = {hit.lower() for hit in EMAIL_KEYWORD_PATTERN.findall(body)}
+        
         # Extract project status updates
-        status_keywords = ['delayed', 'completed', 'cancelled', 'on hold', 'urgent', 'deadline']
-        for keyword in status_keywords:
-            if keyword in subject or keyword in body:
+        for keyword in STATUS_KEYWORDS:
+            if keyword in subject_hits or keyword in body_hits:
                 fact = {
                     'content': f"Email from {sender}: {email.get('subject', '')} - Status: {keyword}",
                     'category': MemoryCategory.PROJECT,
@@ -153,7 +226,7 @@ class MemoryBrain:
                 break
         
         # Extract important contacts
-        if 'urgent' in subject or 'important' in subject or 'asap' in body:
+        if 'urgent' in subject_hits or 'important' in subject_hits or 'asap' in body_hits:
             fact = {
                 'content': f"{sender} sent urgent/important email: {email.get('subject', '')}",
                 'category': MemoryCategory.CONTACT,
@@ -165,14 +238,15 @@ class MemoryBrain:
         
         # Store extracted facts
         if extracted_facts:
-            await self.store_facts(user_id, extracted_facts)
+            await self.store_facts(user_id, extracted_facts, db)
         
         return extracted_facts
     
     async def store_facts(
         self, 
         user_id: str, 
-        facts: List[Dict[str, Any]]
+        facts: List[Dict[str, Any]],
+        db: Optional[Session] = None
     ) -> int:
         """
         Store extracted facts in the database.
@@ -180,57 +254,188 @@ class MemoryBrain:
         Args:
             user_id: The user's ID
             facts: List of facts to store
+            db: Optional request-scoped session; a new one is opened if omitted
         
         Returns:
             Number of facts stored
         """
-        db = SessionLocal()
-        stored_count = 0
+        known = self._known_facts.get(user_id)
+        if known is None:
+            known = self._known_facts[user_id] = {}
         
-        try:
+        # A restated fact already stored at least this confidently would change nothing
+        facts = [fact for fact in facts if fact.get('confidence', 0.5) > known.get(fact['content'], -1.0)]
+        if not facts:
+            return 0
+        
+        result = await asyncio.to_thread(self._store_facts, user_id, facts, db)
+        if result is None:
+            return 0
+        
+        stored_count, reworded = result
+        if reworded:
+            # A merge replaced some stored wording, so restating the old wording must reach the database again
+            self._known_facts.pop(user_id, None)
+        else:
+            # A delete in the meantime popped this dict, so nothing recorded here outlives it
             for fact in facts:
-                # Check for duplicates
-                existing = db.query(MemoryEntry).filter(
-                    MemoryEntry.user_id == user_id,
-                    MemoryEntry.content == fact['content']
-                ).first()
+                known[fact['content']] = max(known.get(fact['content'], 0.0), fact.get('confidence', 0.5))
+        
+        # Confidence bumps change existing memories even when nothing new is stored
+        self._invalidate(user_id)
+        return stored_count
+    
+    def _store_facts(
+        self, 
+        user_id: str, 
+        facts: List[Dict[str, Any]],
+        db: Optional[Session] = None
+    ) -> Optional[Tuple[int, bool]]:
+        """
+        Blocking part of store_facts, run on a worker thread.
+        Returns the number stored and whether a merge replaced any wording, or None if it failed.
+        """
+        result = None
+        
+        with use_session(db) as db:
+            try:
+                # Same content twice in this batch keeps the higher confidence
+                new_rows: Dict[str, Dict[str, Any]] = {}
+                for fact in facts:
+                    row = new_rows.get(fact['content'])
+                    if row is not None:
+                        row['confidence'] = max(row['confidence'], fact.get('confidence', 0.5))
+                        continue
+                    
+                    new_rows[fact['content']] = {
+                        'user_id': user_id,
+                        'content': fact['content'],
+                        'category': fact['category'],
+                        'source': fact['source'],
+                        'confidence': fact.get('confidence', 0.5),
+                        'extra_data': fact.get('extra_data', {}),
+                        'embedding': None
+                    }
                 
-                if existing:
-                    # Update confidence if higher
-                    if fact.get('confidence', 0) > existing.confidence:
-                        existing.confidence = fact['confidence']
-                        existing.updated_at = datetime.utcnow()
-                    continue
+                inserted = []
+                rows = list(new_rows.values())
+                if rows:
+                    # Embed all new entries in one model call
+                    embeddings = embedder.encode_batch(list(new_rows))
+                    if embeddings is not None:
+                        rows = self._merge_near_duplicates(db, user_id, rows, embeddings)
                 
-                # Create new memory entry
-                memory = MemoryEntry(
-                    user_id=user_id,
-                    content=fact['content'],
-                    category=fact['category'],
-                    source=fact['source'],
-                    confidence=fact.get('confidence', 0.5),
-                    extra_data=fact.get('extra_data', {})
-                )
-                db.add(memory)
-                stored_count += 1
+                # Every merged row rewrote a memory or an earlier row in this batch
+                reworded = len(rows) < len(new_rows)
+                
+                if rows:
+                    # Exact duplicates only raise the stored confidence, in the same statement as the inserts
+                    # xmax is 0 only on rows this statement inserted
+                    inserted = db.execute(
+                        _UPSERT_MEMORIES.values(rows).returning(literal_column("xmax = 0"))
+                    ).scalars().all()
+                
+                db.commit()
+                stored_count = sum(inserted)
+                result = (stored_count, reworded)
+                logger.info(f"Stored {stored_count} new memories for user {user_id}")
+                
+            except Exception as e:
+                logger.error(f"Error storing facts: {e}")
+                db.rollback()
+        
+        return result
+    
+    def _merge_near_duplicates(
+        self,
+        db: Session,
+        user_id: str,
+        rows: List[Dict[str, Any]],
+        embeddings: np.ndarray
+    ) -> List[Dict[str, Any]]:
+        """
+        Fold new rows that restate an existing memory, or an earlier row, into it.
+        The newer wording wins, so a changed preference replaces the old one.
+        
+        Args:
+            db: Database session
+            user_id: The user's ID
+            rows: New memory rows, without embeddings
+            embeddings: Normalized embedding of each row's content
+        
+        Returns:
+            The rows that are still new, with their embeddings set
+        """
+        kept = []
+        for row, embedding in zip(rows, embeddings):
+            row['embedding'] = embedding
             
-            db.commit()
-            logger.info(f"Stored {stored_count} new memories for user {user_id}")
+            # Vectors are normalized, so cosine distance is 1 - dot product
+            earlier = next((
+                kept_row for kept_row in kept
+                if kept_row['category'] == row['category']
+                and 1 - float(kept_row['embedding'] @ embedding) < SEMANTIC_DUPLICATE_DISTANCE
+            ), None)
+            if earlier is not None:
+                earlier.update(row, confidence=max(earlier['confidence'], row['confidence']))
+                continue
             
-        except Exception as e:
-            logger.error(f"Error storing facts: {e}")
-            db.rollback()
-        finally:
-            db.close()
+            kept.append(row)
         
-        return stored_count
+        if not kept:
+            return kept
+        
+        # Nearest stored memory for every row, found in one query
+        batch = values(
+            column('idx', Integer),
+            column('content', Text),
+            column('category', String),
+            column('embedding', Vector(EMBEDDING_DIM)),
+            name='batch'
+        ).data([(idx, row['content'], row['category'], row['embedding']) for idx, row in enumerate(kept)])
+        distance = MemoryEntry.embedding.cosine_distance(cast(batch.c.embedding, Vector(EMBEDDING_DIM)))
+        nearest_query = select(MemoryEntry, distance.label('distance')).where(
+            MemoryEntry.user_id == user_id,
+            MemoryEntry.category == batch.c.category,
+            distance < SEMANTIC_DUPLICATE_DISTANCE
+        ).order_by(distance).limit(1).lateral()
+        nearest = aliased(MemoryEntry, nearest_query)
+        
+        # Exact repeats are left to the upsert, which cannot collide with a reworded row
+        exact = select(MemoryEntry.id).where(
+            MemoryEntry.user_id == user_id,
+            func.md5(MemoryEntry.content) == func.md5(batch.c.content)
+        ).exists()
+        
+        # Closest pairs come first, so each memory takes only the row nearest to it and the rest are inserted
+        merged = set()
+        claimed = set()
+        for idx, existing in db.execute(
+            select(batch.c.idx, nearest).select_from(batch).join(nearest, true())
+            .where(~exact).order_by(nearest_query.c.distance)
+        ):
+            if existing.id in claimed:
+                continue
+            
+            row = kept[idx]
+            existing.content = row['content']
+            existing.embedding = row['embedding']
+            existing.source = row['source']
+            existing.extra_data = row['extra_data']
+            existing.confidence = max(existing.confidence, row['confidence'])
+            claimed.add(existing.id)
+            merged.add(idx)
+        
+        return [row for idx, row in enumerate(kept) if idx not in merged]
     
     async def retrieve_relevant_memories(
         self, 
         user_id: str, 
         context: str,
         categories: Optional[List[str]] = None,
-        limit: int = 10
+        limit: int = 10,
+        query_embedding: Optional[np.ndarray] = None,
+        db: Optional[Session] = None
     ) -> List[Dict[str, Any]]:
         """
         Retrieve memories relevant to the current context.
@@ -240,144 +445,189 @@ class MemoryBrain:
             context: Current context/query
             categories: Optional filter by categories
             limit: Maximum memories to retrieve
+            query_embedding: Optional normalized embedding of the context for vector search
+            db: Optional request-scoped session; a new one is opened if omitted
         
         Returns:
             List of relevant memories
         """
-        db = SessionLocal()
-        try:
-            query = db.query(MemoryEntry).filter(MemoryEntry.user_id == user_id)
-            
-            # Filter by categories if specified
-            if categories:
-                query = query.filter(MemoryEntry.category.in_(categories))
-            
-            # Get memories ordered by confidence and recency
-            memories = query.order_by(
-                MemoryEntry.confidence.desc(),
-                MemoryEntry.updated_at.desc()
-            ).limit(limit).all()
-            
-            # Score and filter by relevance to context
-            context_lower = context.lower()
-            relevant_memories = []
-            
-            for memory in memories:
-                relevance_score = 0
-                content_lower = memory.content.lower()
+        # The embedding is derived from the context, so only whether one was given matters
+        cache_key = (context, tuple(categories or ()), limit, query_embedding is not None)
+        reads = self._cached_reads(user_id)
+        memories = reads.get(cache_key)
+        if memories is None:
+            memories = await asyncio.to_thread(
+                self._retrieve_relevant_memories, user_id, context, categories, limit, query_embedding, db
+            )
+            # Failed lookups come back empty; leave those to be retried
+            if memories:
+                reads[cache_key] = memories
+        return memories
+    
+    def _retrieve_relevant_memories(
+        self, 
+        user_id: str, 
+        context: str,
+        categories: Optional[List[str]] = None,
+        limit: int = 10,
+        query_embedding: Optional[np.ndarray] = None,
+        db: Optional[Session] = None
+    ) -> List[Dict[str, Any]]:
+        """Blocking part of retrieve_relevant_memories, run on a worker thread."""
+        with use_session(db) as db:
+            try:
+                query = db.query(MemoryEntry).filter(MemoryEntry.user_id == user_id)
+                
+                # Filter by categories if specified
+                if categories:
+                    query = query.filter(MemoryEntry.category.in_(categories))
                 
-                # Check for keyword overlap
-                context_words = set(context_lower.split())
-                content_words = set(content_lower.split())
-                overlap = len(context_words & content_words)
-                relevance_score += overlap * 0.1
+                if query_embedding is not None:
+                    return self._retrieve_by_vector(query, query_embedding, limit)
+                
+                # Keyword relevance is ranked by Postgres, so only the top rows come back
+                tsquery = func.plainto_tsquery('english', context)
+                matches = MemoryEntry.content_tsv.op('@@')(tsquery)
+                relevance = func.ts_rank(MemoryEntry.content_tsv, tsquery)
                 
                 # Category-based relevance
+                context_lower = context.lower()
+                boosted_categories = []
                 if 'meeting' in context_lower or 'schedule' in context_lower:
-                    if memory.category in [MemoryCategory.SCHEDULE, MemoryCategory.PREFERENCE]:
-                        relevance_score += 0.3
-                
+                    boosted_categories += [MemoryCategory.SCHEDULE, MemoryCategory.PREFERENCE]
                 if 'email' in context_lower or 'mail' in context_lower:
-                    if memory.category in [MemoryCategory.PROJECT, MemoryCategory.CONTACT]:
-                        relevance_score += 0.3
+                    boosted_categories += [MemoryCategory.PROJECT, MemoryCategory.CONTACT]
                 
-                # Add all memories with some relevance or high confidence
-                if relevance_score > 0 or memory.confidence > 0.7:
-                    relevant_memories.append({
-                        'id': str(memory.id),
-                        'content': memory.content,
-                        'category': memory.category,
-                        'source': memory.source,
-                        'confidence': memory.confidence,
-                        'relevance': relevance_score,
-                        'created_at': memory.created_at.isoformat()
-                    })
-            
-            # Sort by combined score
-            relevant_memories.sort(
-                key=lambda x: x['confidence'] + x['relevance'], 
-                reverse=True
-            )
-            
-            return relevant_memories[:limit]
-            
-        except Exception as e:
-            logger.error(f"Error retrieving memories: {e}")
-            return []
-        finally:
-            db.close()
+                # Keep memories with some relevance or high confidence
+                conditions = [matches, MemoryEntry.confidence > 0.7]
+                if boosted_categories:
+                    boosted = MemoryEntry.category.in_(boosted_categories)
+                    relevance = relevance + case((boosted, 0.3), else_=0.0)
+                    conditions.append(boosted)
+                
+                rows = query.add_columns(relevance).filter(or_(*conditions)).order_by(
+                    (MemoryEntry.confidence + relevance).desc(),
+                    MemoryEntry.updated_at.desc()
+                ).limit(limit).all()
+                
+                return [{
+                    'id': str(memory.id),
+                    'content': memory.content,
+                    'category': memory.category,
+                    'source': memory.source,
+                    'confidence': memory.confidence,
+                    'relevance': score,
+                    'created_at': memory.created_at.isoformat()
+                } for memory, score in rows]
+                
+            except Exception as e:
+                logger.error(f"Error retrieving memories: {e}")
+                return []
+    
+    def _retrieve_by_vector(self, query, query_embedding: np.ndarray, limit: int) -> List[Dict[str, Any]]:
+        """Rank memories by cosine similarity using the HNSW index."""
+        distance = MemoryEntry.embedding.cosine_distance(query_embedding)
+        rows = query.add_columns(distance).order_by(distance).limit(limit).all()
+        
+        return [{
+            'id': str(memory.id),
+            'content': memory.content,
+            'category': memory.category,
+            'source': memory.source,
+            'confidence': memory.confidence,
+            # Entries stored before embeddings existed have no distance
+            'relevance': 1 - dist if dist is not None else 0.0,
+            'created_at': memory.created_at.isoformat()
+        } for memory, dist in rows]
     
-    async def get_all_memories(self, user_id: str) -> List[Dict[str, Any]]:
+    async def get_all_memories(self, user_id: str, db: Optional[Session] = None) -> List[Dict[str, Any]]:
         """
         Get all memories for a user.
         
         Args:
             user_id: The user's ID
+            db: Optional request-scoped session; a new one is opened if omitted
         
         Returns:
             List of all memories
         """
-        db = SessionLocal()
-        try:
-            memories = db.query(MemoryEntry).filter(
-                MemoryEntry.user_id == user_id
-            ).order_by(MemoryEntry.updated_at.desc()).all()
-            
-            return [{
-                'id': str(m.id),
-                'content': m.content,
-                'category': m.category,
-                'source': m.source,
-                'confidence': m.confidence,
-                'created_at': m.created_at.isoformat(),
-                'updated_at': m.updated_at.isoformat()
-            } for m in memories]
-            
-        except Exception as e:
-            logger.error(f"Error getting all memories: {e}")
-            return []
-        finally:
-            db.close()
+        reads = self._cached_reads(user_id)
+        memories = reads.get('all')
+        if memories is None:
+            memories = await asyncio.to_thread(self._get_all_memories, user_id, db)
+            if memories:
+                reads['all'] = memories
+        return memories
     
-    async def delete_memory(self, user_id: str, memory_id: str) -> bool:
+    def _get_all_memories(self, user_id: str, db: Optional[Session] = None) -> List[Dict[str, Any]]:
+        """Blocking part of get_all_memories, run on a worker thread."""
+        with use_session(db) as db:
+            try:
+                memories = db.query(MemoryEntry).filter(
+                    MemoryEntry.user_id == user_id
+                ).order_by(MemoryEntry.updated_at.desc()).all()
+                
+                return [{
+                    'id': str(m.id),
+                    'content': m.content,
+                    'category': m.category,
+                    'source': m.source,
+                    'confidence': m.confidence,
+                    'created_at': m.created_at.isoformat(),
+                    'updated_at': m.updated_at.isoformat()
+                } for m in memories]
+                
+            except Exception as e:
+                logger.error(f"Error getting all memories: {e}")
+                return []
+    
+    async def delete_memory(self, user_id: str, memory_id: str, db: Optional[Session] = None) -> bool:
         """
         Delete a specific memory entry.
         
         Args:
             user_id: The user's ID
             memory_id: The memory entry ID
+            db: Optional request-scoped session; a new one is opened if omitted
         
         Returns:
             True if deleted successfully
         """
-        db = SessionLocal()
-        try:
-            memory = db.query(MemoryEntry).filter(
-                MemoryEntry.id == memory_id,
-                MemoryEntry.user_id == user_id
-            ).first()
-            
-            if memory:
-                db.delete(memory)
-                db.commit()
-                logger.info(f"Deleted memory {memory_id} for user {user_id}")
-                return True
-            
-            return False
-            
-        except Exception as e:
-            logger.error(f"Error deleting memory: {e}")
-            db.rollback()
-            return False
-        finally:
-            db.close()
+        deleted = await asyncio.to_thread(self._delete_memory, user_id, memory_id, db)
+        if deleted:
+            self._invalidate(user_id)
+            self._known_facts.pop(user_id, None)
+        return deleted
+    
+    def _delete_memory(self, user_id: str, memory_id: str, db: Optional[Session] = None) -> bool:
+        """Blocking part of delete_memory, run on a worker thread."""
+        with use_session(db) as db:
+            try:
+                memory = db.query(MemoryEntry).filter(
+                    MemoryEntry.id == memory_id,
+                    MemoryEntry.user_id == user_id
+                ).first()
+                
+                if memory:
+                    db.delete(memory)
+                    db.commit()
+                    logger.info(f"Deleted memory {memory_id} for user {user_id}")
+                    return True
+                
+                return False
+                
+            except Exception as e:
+                logger.error(f"Error deleting memory: {e}")
+                db.rollback()
+                return False
     
     async def update_memory(
         self, 
         user_id: str, 
         memory_id: str, 
         new_content: Optional[str] = None,
-        new_confidence: Optional[float] = None
+        new_confidence: Optional[float] = None,
+        db: Optional[Session] = None
     ) -> bool:
         """
         Update a memory entry.
@@ -387,34 +637,51 @@ class MemoryBrain:
             memory_id: The memory entry ID
             new_content: Optional new content
             new_confidence: Optional new confidence score
+            db: Optional request-scoped session; a new one is opened if omitted
         
         Returns:
             True if updated successfully
         """
-        db = SessionLocal()
-        try:
-            memory = db.query(MemoryEntry).filter(
-                MemoryEntry.id == memory_id,
-                MemoryEntry.user_id == user_id
-            ).first()
-            
-            if memory:
-                if new_content:
-                    memory.content = new_content
-                if new_confidence is not None:
-                    memory.confidence = new_confidence
-                memory.updated_at = datetime.utcnow()
-                db.commit()
-                return True
-            
-            return False
-            
-        except Exception as e:
-            logger.error(f"Error updating memory: {e}")
-            db.rollback()
-            return False
-        finally:
-            db.close()
+        updated = await asyncio.to_thread(
+            self._update_memory, user_id, memory_id, new_content, new_confidence, db
+        )
+        if updated:
+            self._invalidate(user_id)
+            self._known_facts.pop(user_id, None)
+        return updated
+    
+    def _update_memory(
+        self, 
+        user_id: str, 
+        memory_id: str, 
+        new_content: Optional[str] = None,
+        new_confidence: Optional[float] = None,
+        db: Optional[Session] = None
+    ) -> bool:
+        """Blocking part of update_memory, run on a worker thread."""
+        with use_session(db) as db:
+            try:
+                memory = db.query(MemoryEntry).filter(
+                    MemoryEntry.id == memory_id,
+                    MemoryEntry.user_id == user_id
+                ).first()
+                
+                if memory:
+                    if new_content and new_content != memory.content:
+                        memory.content = new_content
+                        # None, if the model is unavailable, keeps the edited memory out of vector search
+                        memory.embedding = embedder.encode(new_content)
+                    if new_confidence is not None:
+                        memory.confidence = new_confidence
+                    db.commit()
+                    return True
+                
+                return False
+                
+            except Exception as e:
+                logger.error(f"Error updating memory: {e}")
+                db.rollback()
+                return False
 
 
 # Global instance
@@ -0,0 +1,154 @@
+"""
+Semantic response cache for the AI assistant.
+Reuses LLM responses for user messages that are near-duplicates of earlier ones.
+"""
+from typing import Any, List, Optional
+import hashlib
+import threading
+import logging
+import json
+import io
+import os
+
+import numpy as np
+
+from config import settings
+from embeddings import EMBEDDING_DIM
+from auth import decrypt_bytes, encrypt_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """
+    Flat inner-product index over normalized message embeddings.
+    A cached response is only reused when the stored context key matches,
+    so answers never cross users, conversation histories, memories or differing tool results.
+    """
+
+    def __init__(
+        self,
+        threshold: float = settings.SEMANTIC_CACHE_THRESHOLD,
+        max_entries: int = settings.SEMANTIC_CACHE_MAX_ENTRIES,
+        path: str = settings.SEMANTIC_CACHE_PATH
+    ):
+        """Initialize an empty cache."""
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.path = path
+        self._embeddings = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        self._keys: List[str] = []
+        self._responses: List[str] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    @staticmethod
+    def context_key(user_id: str, tool_name: str, tool_result: Any, conversation: Any = None) -> str:
+        """
+        Build the exact-match part of the cache key.
+
+        Args:
+            user_id: The user's ID
+            tool_name: Names of the tools called this turn
+            tool_result: Tool results, or digests of them
+            conversation: Anything else the response depends on, such as history and memories
+
+        Returns:
+            Key that only matches when all of the above are identical
+        """
+        result_hash = hashlib.sha256(
+            json.dumps([tool_result, conversation], sort_keys=True, default=str).encode()
+        ).hexdigest()
+        return f"{user_id}:{tool_name}:{result_hash}"
+
+    def lookup(self, query: Optional[np.ndarray], context_key: str) -> Optional[str]:
+        """
+        Find a cached response for a query embedding.
+
+        Args:
+            query: Normalized query embedding
+            context_key: Key from context_key() that must match exactly
+
+        Returns:
+            The cached response, or None on a miss
+        """
+        if query is None:
+            return None
+
+        with self._lock:
+            if not self._responses:
+                return None
+
+            # Inner product equals cosine similarity for normalized vectors
+            scores = self._embeddings @ query
+            for idx in np.argsort(-scores):
+                if scores[idx] < self.threshold:
+                    break
+                if self._keys[idx] == context_key:
+                    return self._responses[idx]
+
+        return None
+
+    def add(self, query: Optional[np.ndarray], context_key: str, response: str) -> None:
+        """
+        Store a response for a query embedding.
+
+        Args:
+            query: Normalized query embedding
+            context_key: Key from context_key()
+            response: The LLM response to cache
+        """
+        if query is None:
+            return
+
+        with self._lock:
+            self._embeddings = np.vstack([self._embeddings, query.reshape(1, -1)])
+            self._keys.append(context_key)
+            self._responses.append(response)
+
+            # Evict the oldest entries once over capacity
+            overflow = len(self._responses) - self.max_entries
+            if overflow > 0:
+                self._embeddings = self._embeddings[overflow:]
+                self._keys = self._keys[overflow:]
+                self._responses = self._responses[overflow:]
+
+    def save(self) -> None:
+        """Persist the cache to disk, encrypted since responses quote email and calendar data."""
+        try:
+            buffer = io.BytesIO()
+            with self._lock:
+                np.savez(
+                    buffer,
+                    embeddings=self._embeddings,
+                    keys=np.array(self._keys, dtype=str),
+                    responses=np.array(self._responses, dtype=str)
+                )
+            with open(self.path, "wb") as f:
+                f.write(encrypt_bytes(buffer.getvalue()))
+            logger.info(f"Saved {len(self)} semantic cache entries to {self.path}")
+        except Exception as e:
+            logger.error(f"Error saving semantic cache: {e}")
+
+    def load(self) -> None:
+        """Load a previously persisted cache from disk, if present."""
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, "rb") as f:
+                buffer = io.BytesIO(decrypt_bytes(f.read()))
+            with np.load(buffer, allow_pickle=False) as data:
+                with self._lock:
+                    self._embeddings = data["embeddings"].astype(np.float32)
+                    self._keys = data["keys"].tolist()
+                    self._responses = data["responses"].tolist()
+            logger.info(f"Loaded {len(self)} semantic cache entries from {self.path}")
+        except Exception as e:
+            logger.error(f"Error loading semantic cache: {e}")
+
+
+# Global instance
+semantic_cache = SemanticCache()
@@ -15,7 +15,7 @@ print(f"✓ Google API Key: {settings.GOOGLE_API_KEY[:20]}...")
 print(f"✓ Gemini Model: {settings.GEMINI_MODEL}")
 print(f"✓ Secret Key: {settings.SECRET_KEY[:20]}...")
 print(f"✓ Frontend URL: {settings.FRONTEND_URL}")
-print(f"✓ CORS Origins: {settings.cors_origins_list}")
+print(f"✓ CORS Origins: {settings.CORS_ORIGINS}")
 print(f"✓ Log Level: {settings.LOG_LEVEL}")
 
 print("\n" + "=" * 60)
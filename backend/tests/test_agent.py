@@ -0,0 +1,49 @@
+"""
+Tests for agent intent analysis
+"""
+import asyncio
+
+from agent import get_agent
+
+agent = get_agent()
+
+
+def _actions(message: str) -> list:
+    """Run intent analysis and return the matched (tool, action) pairs."""
+    return [(call["tool"], call["action"]) for call in agent._analyze_intent(message)]
+
+
+def test_phrase_beats_contained_keyword():
+    """Test that "important emails" wins over the plain "email" keyword."""
+    assert _actions("Show me my important emails") == [("gmail", "get_important_emails")]
+
+
+def test_gmail_and_calendar_fan_out():
+    """Test that one call per tool is returned, Gmail first."""
+    assert _actions("Any email about today's schedule?") == [
+        ("gmail", "fetch_emails"),
+        ("calendar", "get_today_schedule"),
+    ]
+
+
+def test_calendar_intent():
+    """Test that calendar keywords are detected."""
+    assert _actions("When is my next meeting?") == [("calendar", "get_next_meeting")]
+
+
+def test_no_intent():
+    """Test that plain conversation does not trigger a tool."""
+    assert _actions("Tell me a joke") == []
+
+
+def test_trivial_message_skips_graph():
+    """Test that greetings are answered without invoking the graph."""
+    before = agent.trivial_skip_total
+    response = asyncio.run(agent.process_message(
+        message="Thanks!",
+        user_id="user-1",
+        conversation_id="conversation-1",
+        message_history=[]
+    ))
+    assert "welcome" in response
+    assert agent.trivial_skip_total == before + 1
@@ -0,0 +1,57 @@
+"""
+Tests for calendar free-slot computation
+"""
+import asyncio
+
+import numpy as np
+
+import auth
+from calendar_tools import CalendarTools, find_free_slots
+
+HOUR = 3600
+
+
+def _slots(busy, window=9 * HOUR, minimum=HOUR):
+    """Run find_free_slots on hour-based intervals and return hour pairs."""
+    busy = (np.array(busy, dtype=float).reshape(-1, 2) * HOUR).astype(np.int64)
+    starts, ends = find_free_slots(busy, window, minimum)
+    return [(int(start) // HOUR, int(end) // HOUR) for start, end in zip(starts, ends)]
+
+
+def test_empty_calendar_is_one_slot():
+    """Test that a day without meetings is entirely free."""
+    assert _slots([]) == [(0, 9)]
+
+
+def test_gaps_between_unsorted_meetings():
+    """Test that gaps are found regardless of event order."""
+    assert _slots([(5, 6), (1, 2)]) == [(0, 1), (2, 5), (6, 9)]
+
+
+def test_overlapping_meetings_do_not_open_gaps():
+    """Test that a meeting nested inside a longer one leaves no slot."""
+    assert _slots([(1, 5), (2, 3), (6, 9)]) == [(0, 1), (5, 6)]
+
+
+def test_short_gaps_are_dropped():
+    """Test that gaps shorter than the requested duration are skipped."""
+    assert _slots([(1, 2), (2.5, 9)], minimum=HOUR) == [(0, 1)]
+
+
+def test_cached_token_skips_session_lookup(monkeypatch):
+    """Test that the stored session is only read when the token cache misses."""
+    lookups = []
+
+    def load(db, user_id, session_id):
+        lookups.append(session_id)
+        return 'pk', 'token', 'refresh'
+
+    monkeypatch.setattr(auth, 'load_session_tokens', load)
+    monkeypatch.setattr(auth, 'decrypt_token', lambda token: token)
+
+    async def run():
+        tools = CalendarTools()
+        return [await tools._get_access_token('user-1', 'session-1', None) for _ in range(3)]
+
+    assert asyncio.run(run()) == ['token'] * 3
+    assert lookups == ['session-1']
@@ -0,0 +1,137 @@
+"""
+Tests for Gmail payload parsing and batch encoding
+"""
+import asyncio
+import base64
+
+import auth
+from gmail_tools import (
+    DETAIL_HEADERS,
+    INTERACTIVE_RETRY,
+    SUMMARY_HEADERS,
+    GmailTools,
+    _backoff_seconds,
+    _build_batch_body,
+    _extract_body,
+    _extract_headers,
+    _parse_batch_response,
+)
+
+
+def _payload(*pairs):
+    """Build a message payload with the given (name, value) headers."""
+    return {'headers': [{'name': name, 'value': value} for name, value in pairs]}
+
+
+def test_only_wanted_headers_are_kept():
+    """Test that unrelated headers are skipped."""
+    payload = _payload(('Received', 'x'), ('From', 'a@b.c'), ('X-Spam', 'no'), ('Subject', 'Hi'))
+    assert _extract_headers(payload, SUMMARY_HEADERS) == {'From': 'a@b.c', 'Subject': 'Hi'}
+
+
+def test_first_occurrence_wins_once_all_found():
+    """Test that scanning stops once every wanted header is found."""
+    payload = _payload(('From', 'a'), ('To', 'b'), ('Subject', 'c'), ('Date', 'd'), ('From', 'later'))
+    assert _extract_headers(payload, DETAIL_HEADERS)['From'] == 'a'
+
+
+def test_missing_headers_list():
+    """Test that a payload without headers yields nothing."""
+    assert _extract_headers({}, SUMMARY_HEADERS) == {}
+
+
+def _part(mime_type, text=None, parts=()):
+    """Build a MIME part with an optional base64url body."""
+    part = {'mimeType': mime_type, 'body': {}, 'parts': list(parts)}
+    if text is not None:
+        part['body']['data'] = base64.urlsafe_b64encode(text.encode()).decode()
+    return part
+
+
+def test_single_part_body_is_used():
+    """Test that a message's own body is returned when it has one."""
+    assert _extract_body(_part('text/html', '<p>hi</p>')) == '<p>hi</p>'
+
+
+def test_nested_plain_text_is_found():
+    """Test that text/plain inside multipart/alternative is found."""
+    payload = _part('multipart/mixed', parts=[
+        _part('multipart/alternative', parts=[_part('text/html', '<b>x</b>'), _part('text/plain', 'x')]),
+        _part('application/pdf', 'pdf')
+    ])
+    assert _extract_body(payload) == 'x'
+
+
+def test_invalid_utf8_is_replaced():
+    """Test that undecodable bytes do not abort extraction."""
+    data = base64.urlsafe_b64encode(b'caf\xe9').decode()
+    assert _extract_body({'body': {'data': data}}) == 'caf�'
+
+
+def test_no_text_part():
+    """Test that a message without text yields an empty body."""
+    assert _extract_body(_part('multipart/mixed', parts=[_part('image/png', 'png')])) == ''
+
+
+def test_batch_body_has_one_part_per_request():
+    """Test that each request becomes an application/http part keyed by index."""
+    body = _build_batch_body('b', [(0, '/gmail/v1/users/me/messages/a'), (3, '/gmail/v1/users/me/messages/d')])
+    assert body.count('--b\r\n') == 2
+    assert 'Content-ID: <3>\r\n\r\nGET /gmail/v1/users/me/messages/d\r\n' in body
+    assert body.endswith('--b--\r\n')
+
+
+def test_batch_response_is_split_by_content_id():
+    """Test that embedded responses are parsed and matched to their request index."""
+    text = (
+        '--batch_x\r\n'
+        'Content-Type: application/http\r\n'
+        'Content-ID: <response-1>\r\n\r\n'
+        'HTTP/1.1 429 Too Many Requests\r\n'
+        'Retry-After: 2\r\n\r\n'
+        '{"error": {}}\r\n'
+        '--batch_x\r\n'
+        'Content-Type: application/http\r\n'
+        'Content-ID: <response-0>\r\n\r\n'
+        'HTTP/1.1 200 OK\r\n'
+        'Content-Type: application/json; charset=UTF-8\r\n\r\n'
+        '{"id": "a"}\r\n'
+        '--batch_x--\r\n'
+    )
+    responses = _parse_batch_response('multipart/mixed; boundary=batch_x', text)
+    assert responses[0] == (200, {'content-type': 'application/json; charset=UTF-8'}, '{"id": "a"}')
+    assert responses[1][0] == 429
+    assert responses[1][1]['retry-after'] == '2'
+
+
+def test_concurrent_401s_refresh_token_once(monkeypatch):
+    """Test that calls rejected with the same stale token share a single refresh."""
+    refreshes = []
+
+    async def refresh(client, refresh_encrypted):
+        refreshes.append(refresh_encrypted)
+        await asyncio.sleep(0)
+        return 'new-token'
+
+    monkeypatch.setattr(auth, 'load_session_tokens', lambda db, user_id, session_id: ('pk', 'old-token', 'refresh'))
+    monkeypatch.setattr(auth, 'decrypt_token', lambda token: token)
+    monkeypatch.setattr(auth, 'refresh_access_token', refresh)
+    monkeypatch.setattr(auth, 'store_access_token', lambda db, session_pk, access_token: None)
+
+    async def run():
+        tools = GmailTools()
+        stale = await tools._get_access_token('user-1', 'session-1', None)
+        return await asyncio.gather(*[
+            tools._get_access_token('user-1', 'session-1', None, stale=stale) for _ in range(5)
+        ])
+
+    assert asyncio.run(run()) == ['new-token'] * 5
+    assert refreshes == ['refresh']
+
+
+def test_backoff_stays_within_retry_budget():
+    """Test that retries stop once the budget is spent or Gmail asks for too long a wait."""
+    assert 1 <= _backoff_seconds(0, None, INTERACTIVE_RETRY) < 2
+    assert _backoff_seconds(0, '3', INTERACTIVE_RETRY) == 3
+    assert _backoff_seconds(0, '60', INTERACTIVE_RETRY) is None
+    assert _backoff_seconds(INTERACTIVE_RETRY.retries, None, INTERACTIVE_RETRY) is None
@@ -0,0 +1,88 @@
+"""
+Tests for memory fact extraction
+"""
+import asyncio
+
+from memory_brain import MemoryBrain, MemoryCategory
+
+
+def _extract(messages: list) -> list:
+    """Run conversation extraction without storing, returning (content, category) pairs."""
+    brain = MemoryBrain()
+
+    async def store_facts(user_id, facts, db=None):
+        return len(facts)
+
+    brain.store_facts = store_facts
+    facts = asyncio.run(brain.extract_facts_from_conversation(messages, "user-1"))
+    return [(fact['content'], fact['category']) for fact in facts]
+
+
+def test_facts_follow_message_order():
+    """Test that facts from several messages come back in conversation order."""
+    messages = [
+        {'role': 'user', 'content': 'I love long walks'},
+        {'role': 'assistant', 'content': 'I hate to say it'},
+        {'role': 'user', 'content': 'Nothing to see here'},
+        {'role': 'user', 'content': "Don't schedule anything on Friday"},
+    ]
+    assert _extract(messages) == [
+        ('I love long walks', MemoryCategory.PREFERENCE),
+        ("Don't schedule anything on Friday", MemoryCategory.SCHEDULE),
+    ]
+
+
+def test_patterns_do_not_span_messages():
+    """Test that a pattern cannot match across the boundary between two messages."""
+    messages = [
+        {'role': 'user', 'content': 'the Apollo'},
+        {'role': 'user', 'content': 'project was fun'},
+    ]
+    assert _extract(messages) == []
+
+
+def test_multiline_message_is_matched_once():
+    """Test that a message with line breaks maps back to itself."""
+    content = 'Hello there\nI always book aisle seats'
+    assert _extract([{'role': 'user', 'content': content}]) == [(content, MemoryCategory.PREFERENCE)]
+
+
+def test_restated_fact_skips_database():
+    """Test that a fact already stored as confidently is not written again."""
+    brain = MemoryBrain()
+    writes = []
+
+    def store(user_id, facts, db=None):
+        writes.append([fact['confidence'] for fact in facts])
+        return len(facts), False
+
+    brain._store_facts = store
+    fact = {'content': 'I love tea', 'category': MemoryCategory.PREFERENCE, 'source': 'chat'}
+
+    asyncio.run(brain.store_facts("user-1", [dict(fact, confidence=0.8)]))
+    asyncio.run(brain.store_facts("user-1", [dict(fact, confidence=0.8)]))
+    asyncio.run(brain.store_facts("user-1", [dict(fact, confidence=0.9)]))
+    assert writes == [[0.8], [0.9]]
+
+
+def test_restating_merged_wording_reaches_database():
+    """Test that wording replaced by a merge is written again when restated."""
+    brain = MemoryBrain()
+    writes = []
+
+    def store(user_id, facts, db=None):
+        writes.append([fact['content'] for fact in facts])
+        # The afternoon preference is merged into the stored morning one
+        reworded = facts[0]['content'] == 'I prefer afternoon meetings'
+        return int(not reworded), reworded
+
+    brain._store_facts = store
+    fact = {'category': MemoryCategory.PREFERENCE, 'source': 'chat', 'confidence': 0.8}
+
+    for content in ['I prefer morning meetings', 'I prefer afternoon meetings', 'I prefer morning meetings']:
+        asyncio.run(brain.store_facts("user-1", [dict(fact, content=content)]))
+    assert writes == [
+        ['I prefer morning meetings'],
+        ['I prefer afternoon meetings'],
+        ['I prefer morning meetings'],
+    ]
@@ -0,0 +1,81 @@
+"""
+Tests for the semantic response cache
+"""
+import numpy as np
+
+from embeddings import EMBEDDING_DIM
+from semantic_cache import SemanticCache
+
+
+def _unit(seed: int) -> np.ndarray:
+    """Build a deterministic normalized vector."""
+    vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_lookup_hits_for_same_query_and_context():
+    """Test that an identical query with the same context is served from cache."""
+    cache = SemanticCache(path="unused.npz")
+    key = SemanticCache.context_key("user-1", "calendar", [{"title": "Standup"}])
+    cache.add(_unit(1), key, "You have a standup.")
+    assert cache.lookup(_unit(1), key) == "You have a standup."
+
+
+def test_lookup_misses_for_different_context():
+    """Test that responses never cross users or tool results."""
+    cache = SemanticCache(path="unused.npz")
+    cache.add(_unit(1), SemanticCache.context_key("user-1", "", None), "Hello Alice")
+    assert cache.lookup(_unit(1), SemanticCache.context_key("user-2", "", None)) is None
+
+
+def test_lookup_misses_below_threshold():
+    """Test that dissimilar queries are not served from cache."""
+    cache = SemanticCache(path="unused.npz")
+    key = SemanticCache.context_key("user-1", "", None)
+    cache.add(_unit(1), key, "cached")
+    assert cache.lookup(_unit(2), key) is None
+
+
+def test_oldest_entries_are_evicted():
+    """Test that the cache stays within max_entries."""
+    cache = SemanticCache(max_entries=2, path="unused.npz")
+    key = SemanticCache.context_key("user-1", "", None)
+    for seed in range(3):
+        cache.add(_unit(seed), key, f"response {seed}")
+    assert len(cache) == 2
+    assert cache.lookup(_unit(0), key) is None
+    assert cache.lookup(_unit(2), key) == "response 2"
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    """Test that the cache persists across restarts."""
+    path = str(tmp_path / "cache.npz")
+    key = SemanticCache.context_key("user-1", "", None)
+    cache = SemanticCache(path=path)
+    cache.add(_unit(1), key, "persisted")
+    cache.save()
+
+    restored = SemanticCache(path=path)
+    restored.load()
+    assert restored.lookup(_unit(1), key) == "persisted"
+
+
+def test_lookup_misses_for_different_history():
+    """Test that a follow-up is not answered with a reply written for another conversation."""
+    cache = SemanticCache(path="unused.npz")
+    first = SemanticCache.context_key("user-1", "", [], {"history": [("user", "Hi")], "memories": []})
+    other = SemanticCache.context_key("user-1", "", [], {"history": [("user", "Hey")], "memories": []})
+    cache.add(_unit(1), first, "You said hi.")
+    assert cache.lookup(_unit(1), other) is None
+
+
+def test_saved_file_is_encrypted(tmp_path):
+    """Test that cached responses are not written to disk in plaintext."""
+    path = str(tmp_path / "cache.npz")
+    cache = SemanticCache(path=path)
+    cache.add(_unit(1), SemanticCache.context_key("user-1", "", None), "secret subject line")
+    cache.save()
+
+    # A plain .npz file is a zip archive
+    with open(path, "rb") as f:
+        assert not f.read().startswith(b"PK")